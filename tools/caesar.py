@@ -7,9 +7,54 @@ __date__    = '2016-04-18'
 __version__ = 1.0
 
 import sys
+import re
+import json
+import multiprocessing
+
+try:
+    maketrans = str.maketrans
+except AttributeError:
+    from string import maketrans
 
 alphabet = "abcdefghijklmnopqrstuvwxyz"
 
+# all symbols which are not in alphabet (in any case)
+NON_ALPHABET_RE = re.compile('[^a-z]')
+NON_LETTERS = bytes(bytearray(c for c in range(256)
+    if not (0x41 <= c <= 0x5a or 0x61 <= c <= 0x7a)))
+
+# number of bytes encrypted/decrypted at once in stream mode
+CHUNK_SIZE = 1 << 20
+
+# largest period tested by the Vigenere analysis (if not given), length of the
+# repeated sequences of the Kasiski test and fraction of the best index of
+# coincidence a period has to reach to be chosen (multiples of the period
+# reach about the same index, they are told apart by the Kasiski score)
+MAX_PERIOD     = 20
+KASISKI_LENGTH = 3
+IOC_THRESHOLD  = 0.9
+
+# number of messages sent to a batch worker at once
+BATCH_CHUNK_SIZE = 64
+
+# ciphertext and Kasiski distances of a worker process
+worker_ciphertext = None
+worker_distances  = None
+
+# translate tables of all keys of a batch worker process
+worker_tables = None
+
+# relative frequencies of the letters a-z in English texts
+ENGLISH_FREQ = [0.08167, 0.01492, 0.02782, 0.04253, 0.12702, 0.02228, 0.02015,
+                0.06094, 0.06966, 0.00153, 0.00772, 0.04025, 0.02406, 0.06749,
+                0.07507, 0.01929, 0.00095, 0.05987, 0.06327, 0.09056, 0.02758,
+                0.00978, 0.02360, 0.00150, 0.01974, 0.00074]
+
+# number of keys shown by the solve mode (if not given) and number of
+# characters decrypted as a sample plaintext of each key
+TOP_KEYS    = 3
+SAMPLE_SIZE = 60
+
 ##{{{ error and usage
 def error(message):
     """ Prints error message."""
@@ -29,9 +74,17 @@ def usage(message):
     error(usage_str)
     print
     print("-----------------------------------------------------------------------------")
-    print("mode(e,c) - encrypt a file (e) or show keys/plaintexts for a ciphertext(c)")
-    print("file      - contains the plaintext")
-    print("key       - key for the CAESAR cipher")
+    print("mode(e,c,s) - encrypt a file (e) or show keys/plaintexts for a ciphertext(c)")
+    print("              or show the most likely keys for a ciphertext (s)")
+    print("mode(E,D)   - encrypt (E) or decrypt (D) a file of any size as a stream")
+    print("              to stdout (letters only, no formatting)")
+    print("mode(v)     - find period and key of a Vigenere ciphertext")
+    print("mode(b)     - solve/encrypt/decrypt many messages; file lists paths or")
+    print("              NDJSON records {id, text, mode (s,e,d), key} ('-': stdin),")
+    print("              one NDJSON result per line")
+    print("file        - contains the plaintext ('-': stdin)")
+    print("key         - key for the CAESAR cipher (s: number of keys shown,")
+    print("              v: largest period tested, b: number of processes)")
     print("-----------------------------------------------------------------------------")
     exit(1)
 ##}}}
@@ -43,18 +96,31 @@ def read_file(f):
     containing all symbols found in alphabet
     """
     content = f.read()
-    content = content.replace('\n','').lower()
-
-    output = ""
 
     # clean string (remove extra symbols, white space, ...)
-    for c in content:
-        if c not in alphabet:
-            continue
-        else:
-            output += c
+    return NON_ALPHABET_RE.sub('', content.lower())
+##}}}
+
+##{{{ translate tables
+def get_table(k):
+    """
+    returns the translate table shifting each symbol of alphabet by k
+    """
+    k = k % 26
+    return maketrans(alphabet, alphabet[k:] + alphabet[:k])
+
 
-    return output
+def get_stream_table(k):
+    """
+    returns the translate table (bytes) shifting each letter by k and mapping
+    it to lower case, all other bytes are deleted by NON_LETTERS
+    """
+    table = bytearray(range(256))
+    for (i, ch) in enumerate(bytearray(alphabet.encode('ascii'))):
+        shifted = ord(alphabet[(i + k) % 26])
+        table[ch] = shifted
+        table[ch - 0x20] = shifted
+    return bytes(table)
 ##}}}
 
 ##{{{ caesar encrypt
@@ -63,14 +129,7 @@ def caesar_encrypt(p,k):
     gets a plaintext p (string) and a key k (numeric) as input and encrypts p
     using the CAESAR cipher with the key K
     """
-    ciphertext = ""
-
-    for c in p:
-        c_pos       = alphabet.index(c)
-        new_char    = alphabet[(c_pos + k) % 26] 
-        ciphertext += new_char
-
-    return ciphertext
+    return p.translate(get_table(k))
 ##}}}
 
 ##{{{ caesar decrypt
@@ -79,14 +138,23 @@ def caesar_decrypt(c,k):
     gets a ciphertext c (string) and a key k (numeric) as input and decrypts c
     using the CAESAR cipher with the key K
     """
-    plaintext = ""
+    return c.translate(get_table(-k))
+##}}}
 
-    for ch in c:
-        c_pos      = alphabet.index(ch)
-        new_char   = alphabet[(c_pos - k) % 26] 
-        plaintext += new_char
+##{{{ caesar stream
+def caesar_stream(f_in, f_out, k, chunk_size=CHUNK_SIZE):
+    """
+    encrypts the file f_in (binary) with the key k (decrypts it with -k) chunk
+    by chunk and writes the result to f_out; like read_file, only the letters
+    are kept (in lower case)
+    """
+    table = get_stream_table(k)
 
-    return plaintext
+    while True:
+        chunk = f_in.read(chunk_size)
+        if not chunk:
+            break
+        f_out.write(chunk.translate(table, NON_LETTERS))
 ##}}}
 
 ##{{{ print
@@ -114,6 +182,234 @@ def show_possible_plaintexts(c):
         print_format(tmp_str, plaintext)
 ##}}}
 
+##{{{ solve
+def get_histogram(c):
+    """ returns the number of occurrences of each letter of alphabet in c """
+    return [c.count(ch) for ch in alphabet]
+
+
+def chi_squared(histogram, k):
+    """
+    returns the chi-squared statistic of the plaintext letters for the key k
+    against ENGLISH_FREQ; the histogram of the plaintext is the histogram of
+    the ciphertext rotated by k
+    """
+    total    = sum(histogram)
+    rotated  = histogram[k:] + histogram[:k]
+    score    = 0.0
+
+    if total == 0:
+        return score
+
+    for (observed, freq) in zip(rotated, ENGLISH_FREQ):
+        expected = total * freq
+        score += (observed - expected) ** 2 / expected
+
+    return score
+
+
+def rank_histogram(histogram):
+    """
+    scores all keys by the letter histogram of a ciphertext and returns them
+    as a list of (score, key), best key first
+    """
+    return sorted((chi_squared(histogram, k), k) for k in range(26))
+
+
+def rank_keys(c):
+    """
+    scores all keys of a ciphertext c by a single letter histogram and returns
+    them as a list of (score, key), best key first
+    """
+    return rank_histogram(get_histogram(c))
+
+
+def show_best_plaintexts(c, top=TOP_KEYS):
+    for (score, k) in rank_keys(c)[:top]:
+        plaintext = caesar_decrypt(c[:SAMPLE_SIZE], k)
+        tmp_str = "Key = " + str(k) + " (chi^2 = " + \
+                str(round(score, 1)) + "): Plaintext = "
+        print_format(tmp_str, plaintext)
+##}}}
+
+##{{{ vigenere
+def vigenere_decrypt(c, key):
+    """
+    decrypts a ciphertext c encrypted with a Vigenere key (list of numeric
+    keys): every column of c is a CAESAR ciphertext
+    """
+    period    = len(key)
+    plaintext = list(c)
+
+    for (j, k) in enumerate(key):
+        plaintext[j::period] = caesar_decrypt(c[j::period], k)
+
+    return "".join(plaintext)
+
+
+def get_kasiski_distances(c, length=KASISKI_LENGTH):
+    """
+    returns the distances between consecutive occurrences of all repeated
+    sequences of length letters in c (Kasiski test)
+    """
+    last_pos  = {}
+    distances = []
+
+    for i in range(len(c) - length + 1):
+        sequence = c[i:i + length]
+        if sequence in last_pos:
+            distances.append(i - last_pos[sequence])
+        last_pos[sequence] = i
+
+    return distances
+
+
+def init_worker(c, distances):
+    global worker_ciphertext, worker_distances
+
+    worker_ciphertext = c
+    worker_distances  = distances
+
+
+def analyze_period(period):
+    """
+    Splits the ciphertext of the worker into period columns and returns
+    (period, index of coincidence, Kasiski score, key). All statistics are
+    computed from the letter histograms of the columns: the index of
+    coincidence is averaged over the columns, the Kasiski score is the
+    fraction of the distances divisible by the period and the key consists of
+    the best key of each column.
+    """
+    c        = worker_ciphertext
+    ioc      = 0.0
+    key      = []
+
+    for j in range(period):
+        histogram = get_histogram(c[j::period])
+        total     = sum(histogram)
+        if total > 1:
+            ioc += sum(n * (n - 1) for n in histogram) / \
+                    float(total * (total - 1))
+        key.append(rank_histogram(histogram)[0][1])
+
+    kasiski = 0.0
+    if worker_distances:
+        kasiski = sum(1 for d in worker_distances if d % period == 0) / \
+                float(len(worker_distances))
+
+    return (period, ioc / period, kasiski, key)
+
+
+def analyze_vigenere(c, max_period=MAX_PERIOD, processes=None):
+    """
+    evaluates all periods up to max_period in a pool of processes and returns
+    the results of analyze_period (ordered by period) and the chosen one:
+    among the periods whose index of coincidence reaches IOC_THRESHOLD of the
+    best one, the period with the best Kasiski score (a multiple of the period
+    only divides about half of the distances) and then the smallest one
+    """
+    max_period = max(1, min(max_period, len(c) // 2))
+    distances  = get_kasiski_distances(c)
+
+    pool = multiprocessing.Pool(processes, init_worker, (c, distances))
+    try:
+        results = pool.map(analyze_period, range(1, max_period + 1))
+    finally:
+        pool.terminate()
+        pool.join()
+
+    best_ioc   = max(ioc for (period, ioc, kasiski, key) in results)
+    candidates = [result for result in results
+            if result[1] >= IOC_THRESHOLD * best_ioc]
+    best = max(candidates, key=lambda result: (result[2], -result[0]))
+
+    return (results, best)
+
+
+def show_vigenere(c, max_period=MAX_PERIOD):
+    (results, best) = analyze_vigenere(c, max_period)
+
+    print("Period   IoC      Kasiski  Key")
+    for (period, ioc, kasiski, key) in results:
+        print("{0:6d}   {1:.4f}   {2:.4f}   {3}".format(period, ioc, kasiski,
+            "".join(alphabet[k] for k in key)))
+
+    (period, ioc, kasiski, key) = best
+    plaintext = vigenere_decrypt(c[:SAMPLE_SIZE], key)
+    tmp_str = "Period = " + str(period) + ", Key = " + \
+            "".join(alphabet[k] for k in key) + ": Plaintext = "
+    print_format(tmp_str, plaintext)
+##}}}
+
+##{{{ batch
+def init_batch_worker():
+    global worker_tables
+
+    worker_tables = [get_table(k) for k in range(26)]
+
+
+def process_message(job):
+    """
+    Processes one line (number, line) of a batch file: either the path of a
+    ciphertext file or a NDJSON record with the text, the mode (s: solve,
+    default; e: encrypt; d: decrypt) and the key. Returns the result as a
+    NDJSON line; the id defaults to the path or the line number.
+    """
+    (number, line) = job
+    line   = line.strip()
+    result = {"id": number}
+
+    try:
+        if line.startswith('{'):
+            record = json.loads(line)
+            text   = record.get("text", "")
+        else:
+            record = {"id": line}
+            result["id"] = line
+            with open(line) as f:
+                text = f.read()
+        result["id"] = record.get("id", number)
+
+        mode = record.get("mode", "s")
+        text = str(NON_ALPHABET_RE.sub('', text.lower()))
+        result["mode"] = mode
+
+        if mode == 'e':
+            k = int(record["key"]) % 26
+            result["ciphertext"] = text.translate(worker_tables[k])
+        elif mode == 'd':
+            k = int(record["key"]) % 26
+            result["plaintext"] = text.translate(worker_tables[-k % 26])
+        elif mode == 's':
+            (score, k) = rank_keys(text)[0]
+            result["score"] = round(score, 3)
+            result["plaintext"] = text.translate(worker_tables[-k % 26])
+        else:
+            raise ValueError("'" + str(mode) + "' is not a valid mode")
+        result["key"] = k
+    except (IOError, ValueError, KeyError, TypeError, AttributeError) as e:
+        result["error"] = str(e)
+
+    return json.dumps(result, sort_keys=True)
+
+
+def run_batch(f, processes=None):
+    """
+    processes all lines of a batch file f in a pool of processes and writes the
+    results in the order of the lines to stdout
+    """
+    jobs = ((number, line) for (number, line) in enumerate(f, 1)
+            if line.strip())
+
+    pool = multiprocessing.Pool(processes, init_batch_worker)
+    try:
+        for result in pool.imap(process_message, jobs, BATCH_CHUNK_SIZE):
+            sys.stdout.write(result + "\n")
+    finally:
+        pool.terminate()
+        pool.join()
+##}}}
+
 ##{{{ main
 def main():
     # check number of arguments
@@ -124,21 +420,58 @@ def main():
     # if e: all arguments are required
     # if c: no key is required (but may be given)
     # check if mode is character and valid
-    if sys.argv[1].isalpha() and (sys.argv[1] == 'e' or sys.argv[1] == 'c'):
+    if sys.argv[1].isalpha() and (sys.argv[1] in ('e', 'c', 's', 'E', 'D', 'v', 'b')):
         mode = sys.argv[1]
     else:
         error_str = "Argument '" + sys.argv[1] + "' is not a valid mode"
         usage(error_str)
 
-    if mode == 'e':
+    if mode in ('e', 'E', 'D'):
         if len(sys.argv) != 4:
             usage("")
-        if not unicode(sys.argv[3], 'utf-8').isnumeric() or int(sys.argv[3]) < 0:
+        if not sys.argv[3].isdigit() or int(sys.argv[3]) < 0:
             error_str = "Argument '" + sys.argv[3] + "' is not valid"
             usage(error_str)
     elif mode == 'c':
         if len(sys.argv) != 4 and len(sys.argv) != 3:
             usage("")
+    elif mode in ('s', 'v', 'b'):
+        if len(sys.argv) == 4 and (not sys.argv[3].isdigit() or
+                int(sys.argv[3]) < 1):
+            error_str = "Argument '" + sys.argv[3] + "' is not valid"
+            usage(error_str)
+
+    if mode in ('E', 'D'):
+        try:
+            if sys.argv[2] == '-':
+                f = getattr(sys.stdin, 'buffer', sys.stdin)
+            else:
+                f = open(sys.argv[2], 'rb')
+        except:
+            error_str = "File '" + sys.argv[2] + "' not found"
+            usage(error_str)
+
+        key = int(sys.argv[3])
+        if mode == 'D':
+            key = -key
+        caesar_stream(f, getattr(sys.stdout, 'buffer', sys.stdout), key)
+        return
+
+    if mode == 'b':
+        try:
+            if sys.argv[2] == '-':
+                f = sys.stdin
+            else:
+                f = open(sys.argv[2])
+        except:
+            error_str = "File '" + sys.argv[2] + "' not found"
+            usage(error_str)
+
+        processes = None
+        if len(sys.argv) == 4:
+            processes = int(sys.argv[3])
+        run_batch(f, processes)
+        return
 
     # check if file exists
     try:
@@ -154,6 +487,18 @@ def main():
         plaintext  = read_file(f)
         ciphertext = caesar_encrypt(plaintext, key)
         print_format("Ciphertext: ", ciphertext)
+    elif mode == 's':
+        ciphertext = read_file(f)
+        top = TOP_KEYS
+        if len(sys.argv) == 4:
+            top = int(sys.argv[3])
+        show_best_plaintexts(ciphertext, top)
+    elif mode == 'v':
+        ciphertext = read_file(f)
+        max_period = MAX_PERIOD
+        if len(sys.argv) == 4:
+            max_period = int(sys.argv[3])
+        show_vigenere(ciphertext, max_period)
     else:
         ciphertext = read_file(f)
         show_possible_plaintexts(ciphertext)
@@ -3,13 +3,91 @@
 
 from __future__ import with_statement
 import sys
+import os
 import argparse
+import binascii
 import hashlib
-import time
+import heapq
+import json
+import mmap
+import socket
+import tempfile
 import threading
+import time
+import timeit
+import multiprocessing
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
 
-hash_counter = 0
 LOWER_CASE_RANGE = range(0x61, 0x7b) # A-Z = [0x41-0x5a]
+UPPER_CASE_RANGE = range(0x41, 0x5b) # a-z = [0x61-0x7a]
+DIGIT_RANGE = range(0x30, 0x3a)
+SPECIAL_RANGE = [c for c in range(0x20, 0x7f) if not chr(c).isalnum()]
+
+# charsets of the mask placeholders, e.g. ?u?l?l?l?d?d
+MASK_CHARSETS = {
+    'l': bytearray(LOWER_CASE_RANGE),
+    'u': bytearray(UPPER_CASE_RANGE),
+    'd': bytearray(DIGIT_RANGE),
+    's': bytearray(SPECIAL_RANGE),
+    'a': bytearray(list(LOWER_CASE_RANGE) + list(UPPER_CASE_RANGE) +
+        list(DIGIT_RANGE) + SPECIAL_RANGE),
+}
+
+# number of candidates handed out to a worker process at once
+CHUNK_SIZE = 1 << 16
+
+# supported hash algorithms; without --format the algorithm of a hash is
+# detected by the size of its digest
+HASH_ALGORITHMS = {
+    "md5": hashlib.md5,
+    "sha1": hashlib.sha1,
+    "sha256": hashlib.sha256,
+    "sha512": hashlib.sha512,
+}
+ALGORITHM_BY_DIGEST_SIZE = dict((HASH_ALGORITHMS[a]().digest_size, a)
+        for a in HASH_ALGORITHMS)
+
+# separates the salt from the hash in salted lines (salt$hash)
+SALT_SEPARATOR = '$'
+DIGEST_SIZE_SHA1 = hashlib.sha1().digest_size
+
+# number of wordlist bytes handed out to a worker process at once
+WORDLIST_CHUNK_SIZE = 1 << 20
+
+# seconds between two checkpoints of a run
+CHECKPOINT_INTERVAL = 60
+
+# seconds between two status reports of a run
+STATUS_INTERVAL = 10
+
+# number of digests sorted in memory at once while building an index file
+# and size of the (JSON, space padded) header of an index file
+INDEX_RUN_SIZE = 1 << 22
+INDEX_HEADER_SIZE = 4096
+
+# seconds between two heartbeats of a remote worker and seconds without any
+# message after which the coordinator reassigns the ranges of a worker
+HEARTBEAT_INTERVAL = 5
+WORKER_TIMEOUT = 30
+
+# benchmarks: candidates per measurement, measurements per benchmark (the best
+# one counts) and the slowdown against the baseline reported as regression
+BENCH_SIZE = 1 << 17
+BENCH_REPEAT = 3
+BENCH_TOLERANCE = 0.1
+
+# number of records a worker process sorts at once while building a lookup
+# table and size of the (JSON, space padded) header of a lookup table
+TABLE_RUN_SIZE = 1 << 21
+TABLE_HEADER_SIZE = 256
+
+# target hashes and options (charset, wordlist, rules, ...) of the current
+# worker process (set by init_worker)
+worker_hashes = None
+worker_options = None
 
 #{{{ error and usage
 def error(message):
@@ -29,18 +107,246 @@ def usage(message):
     error(usage_str)
     print('\n')
     print("-------------------------------------------------------------------")
-    print("file   - path to a file containing the hashes (one per line)")
+    print("file   - path to a file containing the hashes (one per line, salted")
+    print("         hashes as salt$hash where hash = H(salt + password))")
+    print("mode   - [brute, wordlist, mask, build, lookup]:")
+    print("         brute    (all passwords of size min to max)")
+    print("         wordlist (words of a wordlist + rules)")
+    print("         mask     (one charset per position, e.g. ?u?l?l?l?d?d)")
+    print("         build    (precompute a lookup table for size min to max)")
+    print("         lookup   (resolve the hashes with a lookup table)")
+    print("         worker   (crack ranges handed out by a coordinator, see")
+    print("                   --serve and --connect)")
+    print("         bench    (measure the throughput, compare to --baseline)")
+    print("mask   - ?l (a-z), ?u (A-Z), ?d (0-9), ?s (special), ?a (all),")
+    print("         ?? (a literal '?'), every other character is literal")
+    print("rules  - comma separated rules, each a chain of transformations")
+    print("         joined by '+', e.g. ':,capitalize+digits,leet,append:!'")
+    print("         (" + ", ".join(sorted(RULES)) + ", append:<s>,")
+    print("          prepend:<s>)")
     print("-------------------------------------------------------------------")
     exit(1)
 #}}}
 
 ##{{{ read file
-def read_file(f):
+def parse_hash(line, algorithm=None):
+    """
+    converts a line (hash or salt$hash, hex encoded) into the tuple (algorithm,
+    salt, raw digest). If no algorithm is given, it is detected by the size of
+    the digest. Raises a ValueError if the line is not a valid hash.
     """
-    reads the content of a given file f and returns its content as an array (one
-    entry reflects one line)
+    salt = ''
+    h = line
+    if SALT_SEPARATOR in line:
+        (salt, h) = line.rsplit(SALT_SEPARATOR, 1)
+
+    try:
+        digest = binascii.unhexlify(h)
+    except (TypeError, binascii.Error):
+        raise ValueError("invalid hash '" + line + "'")
+
+    if algorithm is None:
+        algorithm = ALGORITHM_BY_DIGEST_SIZE.get(len(digest))
+    if algorithm is None or \
+            len(digest) != HASH_ALGORITHMS[algorithm]().digest_size:
+        raise ValueError("invalid hash '" + line + "'")
+
+    return (algorithm, salt, digest)
+
+
+def read_file(f, algorithm=None):
     """
-    return f.read().split('\n')
+    reads a given file f containing one hash per line and returns a dictionary
+    which maps every distinct pair (algorithm, salt) to the deduplicated set of
+    raw digests, so that every candidate has to be hashed only once per pair
+    """
+    groups = {}
+
+    for line in f:
+        line = line.strip()
+        if line:
+            (alg, salt, digest) = parse_hash(line, algorithm)
+            groups.setdefault((alg, salt), set()).add(digest)
+
+    return groups
+##}}}
+
+##{{{ sorted digest index
+def read_records(f, record_size):
+    """ yields the fixed size records of a binary file f """
+    record = f.read(record_size)
+    while record:
+        yield record
+        record = f.read(record_size)
+
+
+def get_index_header(hash_path, algorithm):
+    """
+    returns the header of a HashIndex of the hash file hash_path (algorithm
+    and path, size and mtime of the hash file)
+    """
+    st = os.stat(hash_path)
+    return {"algorithm": algorithm, "source": os.path.abspath(hash_path),
+            "size": st.st_size, "mtime": st.st_mtime}
+
+
+def build_index(f, path, algorithm, run_size=INDEX_RUN_SIZE):
+    """
+    reads a given file f containing one unsalted hash of the given algorithm
+    per line and writes the deduplicated raw digests as sorted fixed size
+    records to path (see HashIndex). The digests are sorted in runs of
+    run_size records which are merged afterwards, so the hash file never has
+    to fit into memory.
+    """
+    header = json.dumps(get_index_header(f.name, algorithm)).encode()
+    if len(header) > INDEX_HEADER_SIZE - 1:
+        raise ValueError("index header exceeds " + str(INDEX_HEADER_SIZE) +
+                " bytes (path of the hash file too long)")
+
+    runs = []
+
+    def write_run(digests):
+        run = tempfile.TemporaryFile()
+        run.write(b''.join(sorted(digests)))
+        run.seek(0)
+        runs.append(run)
+
+    digests = set()
+    for line in f:
+        line = line.strip()
+        if line:
+            (alg, salt, digest) = parse_hash(line, algorithm)
+            if salt:
+                raise ValueError("salted hash '" + line + "' (not supported\
+ by --index)")
+            digests.add(digest)
+        if len(digests) >= run_size:
+            write_run(digests)
+            digests = set()
+    if digests or not runs:
+        write_run(digests)
+
+    prev = None
+    with open(path, 'wb') as out:
+        out.write(header.ljust(INDEX_HEADER_SIZE - 1) + b'\n')
+        record_size = HASH_ALGORITHMS[algorithm]().digest_size
+        merged = heapq.merge(*[read_records(run, record_size) for run in runs])
+        for digest in merged:
+            if digest != prev:
+                out.write(digest)
+                prev = digest
+
+    for run in runs:
+        run.close()
+
+
+class DigestIndex(object):
+    """
+    Read-only set of digests stored as sorted fixed size records in a file
+    (starting at offset, the first key_size bytes of a record are the digest).
+    The file is memory-mapped and searched by bisection, so it does not have to
+    fit into memory and is shared between all processes through the page
+    cache.
+    """
+
+    def __init__(self, path, record_size, offset=0, key_size=None):
+        self.path = path
+        self.record_size = record_size
+        self.offset = offset
+        self.key_size = key_size or record_size
+        size = max(os.path.getsize(path) - offset, 0)
+        if size % record_size:
+            raise ValueError("size of '" + path + "' is not a multiple of " +
+                    str(record_size) + " bytes")
+        self.count = size // record_size
+        self.f = open(path, 'rb')
+        self.map = None
+        if self.count:
+            self.map = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return self.count
+
+    def record(self, i):
+        """ returns the record with index i """
+        start = self.offset + i * self.record_size
+        return self.map[start:start + self.record_size]
+
+    def find(self, digest):
+        """ returns the index of the record of digest or -1 """
+        size = self.record_size
+        key_size = self.key_size
+        lo = 0
+        hi = self.count
+
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = self.offset + mid * size
+            key = self.map[start:start + key_size]
+            if key < digest:
+                lo = mid + 1
+            elif key > digest:
+                hi = mid
+            else:
+                return mid
+
+        return -1
+
+    def __contains__(self, digest):
+        return self.find(digest) != -1
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self.record(i)[:self.key_size]
+
+    # the mapping can not be pickled, worker processes reopen the file instead
+    def __getstate__(self):
+        return (self.path, self.record_size, self.offset, self.key_size)
+
+    def __setstate__(self, state):
+        DigestIndex.__init__(self, *state)
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+        self.f.close()
+
+
+class HashIndex(DigestIndex):
+    """
+    Index of an unsalted hash file built by build_index: a JSON header (see
+    get_index_header) padded to INDEX_HEADER_SIZE bytes, followed by the
+    sorted digests.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            header = json.loads(f.read(INDEX_HEADER_SIZE).decode())
+        self.header = header
+        digest_size = HASH_ALGORITHMS[header["algorithm"]]().digest_size
+        DigestIndex.__init__(self, path, digest_size, INDEX_HEADER_SIZE)
+
+
+def open_index(f, path, algorithm):
+    """
+    returns the HashIndex at path of the hash file f; the index is (re)built
+    if it does not exist or belongs to another hash file, algorithm or an
+    older version of the hash file. Raises an IOError if path exists but is
+    not an index file.
+    """
+    if os.path.exists(path):
+        try:
+            index = HashIndex(path)
+        except (ValueError, KeyError, UnicodeDecodeError):
+            raise IOError("'" + path + "' is not an index file")
+        if index.header == get_index_header(f.name, algorithm):
+            return index
+        index.close()
+        print("Index '{0}' belongs to another hash file, rebuilding".format(
+            path))
+
+    build_index(f, path, algorithm)
+    return HashIndex(path)
 ##}}}
 
 ###{{{ get next password candidate
@@ -74,123 +380,1487 @@ def read_file(f):
 #    return charset
 ###}}}
 
-##{{{ get next password candidate (generic)
-def get_next_pw(m, i, num_chars, char):
-    for j in reversed(range(num_chars)):
-        rest = i % char
-        i = i / char
-        m[j] = chr(LOWER_CASE_RANGE[rest])
-
-    return m
-##}}}
-
-##{{{ class thread_crack_pw
-class thread_crack_pw(threading.Thread):
-    def __init__(self, name, min_size, size, hashes, num_of_hashes, full_size):
-        threading.Thread.__init__(self)
-        self.name = name
-        self.min_size = min_size
-        self.size = size
-        self.hashes = hashes
-        self.num_of_hashes = num_of_hashes
-        self.full_size = full_size
-
-    def crack(self, curr):
-        global hash_counter
-
-        for i in range(0, pow(26, self.size)):
-            curr = get_next_pw(curr, i, self.size, len(LOWER_CASE_RANGE))
-            s = ''.join(curr)
-            h2 = hashlib.sha1(s).hexdigest()
-            if h2 in self.hashes:
-                # maybe it is required to lock hash_counter
-                hash_counter += 1
-                print("Passwort: " + s)
-                print("Hashwert: " + h2)
-            if hash_counter == self.num_of_hashes:
-                break
+##{{{ get password candidate by index
+def get_positions(charsets, index):
+    """
+    maps a flat index to the positions within the charsets (mixed radix, the
+    last position changes fastest)
+    """
+    pos = [0] * len(charsets)
+    for j in reversed(range(len(charsets))):
+        pos[j] = index % len(charsets[j])
+        index = index // len(charsets[j])
+    return pos
+
+
+def get_candidate(charsets, index):
+    """ returns the candidate (bytes) with a given index """
+    pos = get_positions(charsets, index)
+    return bytes(bytearray(charsets[j][pos[j]] for j in range(len(charsets))))
+
 
-    def run(self):
-        print("Starting Thread {0}\n".format(self.name))
+def get_num_candidates(charsets):
+    """ returns the number of candidates for a given list of charsets """
+    num_candidates = 1
+    for charset in charsets:
+        num_candidates *= len(charset)
+    return num_candidates
+##}}}
+
+##{{{ parse mask
+def parse_mask(mask):
+    """
+    converts a mask (e.g. ?u?l?l?l?d?d) into the list of charsets (one per
+    position), raises a ValueError for invalid masks
+    """
+    charsets = []
+    i = 0
 
-        if not self.full_size:
-            for i in range(self.min_size, self.size):
-                curr = ['' for i in range(self.size)]
-                self.crack(curr)
+    while i < len(mask):
+        if mask[i] != '?':
+            if ord(mask[i]) > 0x7f:
+                raise ValueError("non-ASCII character '" + mask[i] + "'")
+            charsets.append(bytearray([ord(mask[i])]))
+            i += 1
+            continue
+        if i + 1 == len(mask):
+            raise ValueError("incomplete placeholder at the end")
+        if mask[i + 1] == '?':
+            charsets.append(bytearray(b'?'))
+        elif mask[i + 1] in MASK_CHARSETS:
+            charsets.append(MASK_CHARSETS[mask[i + 1]])
         else:
-            curr = ['' for i in range(self.size)]
-            self.crack(curr)
-       
-        print("Thread {0} terminated\n".format(self.name))
+            raise ValueError("unknown placeholder '?" + mask[i + 1] + "'")
+        i += 2
+
+    if not charsets:
+        raise ValueError("empty mask")
+
+    return charsets
+##}}}
+
+##{{{ generate password candidates (odometer)
+def generate_candidates(charsets, start, end):
+    """
+    yields the candidates with index start to end - 1, where charsets holds one
+    charset (bytearray) per position and the last position changes fastest.
+    Only the starting candidate is computed by division; afterwards the same
+    bytearray is advanced in place (odometer-style carry) and yielded again, so
+    callers have to copy it if they want to keep a candidate.
+    """
+    size = len(charsets)
+    last = size - 1
+    radices = [len(charset) for charset in charsets]
+    pos = get_positions(charsets, start)
+
+    buf = bytearray(charsets[j][pos[j]] for j in range(size))
+    remaining = end - start
+    last_pos = pos[last]
+
+    while remaining > 0:
+        # the last position is advanced by iterating its charset directly
+        stop = min(radices[last], last_pos + remaining)
+        for c in charsets[last][last_pos:stop]:
+            buf[last] = c
+            yield buf
+        remaining -= stop - last_pos
+        last_pos = 0
+
+        # carry into the remaining positions
+        j = last - 1
+        while j >= 0:
+            pos[j] += 1
+            if pos[j] < radices[j]:
+                buf[j] = charsets[j][pos[j]]
+                break
+            pos[j] = 0
+            buf[j] = charsets[j][0]
+            j -= 1
+##}}}
+
+##{{{ walk password candidates with prefix hashes
+def walk_prefix_hashes(charsets, start, end, base):
+    """
+    yields the candidates with index start to end - 1 (same order as
+    generate_candidates) together with a hash object fed with the candidate.
+    Every prefix is fed into a copy of the hash object base only once and the
+    resulting state is copied for all of its extensions. hashlib only
+    compresses complete blocks (64 bytes for md5/sha1/sha256, 128 for sha512)
+    and buffers the rest, so compression work is only shared once a prefix
+    exceeds the block size; for shorter candidates the copies make this slower
+    than hashing every candidate from scratch (see use_prefix_hashes).
+    """
+    size = len(charsets)
+    last = size - 1
+    radices = [len(charset) for charset in charsets]
+    # single byte strings of every charset to feed the hash objects
+    symbols = [[bytes(bytearray([c])) for c in charset] for charset in charsets]
+
+    pos = get_positions(charsets, start)
+
+    buf = bytearray(charsets[j][pos[j]] for j in range(size))
+
+    # states[j] holds the hash state after feeding the first j characters
+    states = [base.copy()] + [None] * last
+    for j in range(last):
+        states[j + 1] = states[j].copy()
+        states[j + 1].update(symbols[j][pos[j]])
+
+    remaining = end - start
+    last_pos = pos[last]
+
+    while remaining > 0:
+        stop = min(radices[last], last_pos + remaining)
+        prefix_state = states[last]
+        for k in range(last_pos, stop):
+            buf[last] = charsets[last][k]
+            h = prefix_state.copy()
+            h.update(symbols[last][k])
+            yield (buf, h)
+        remaining -= stop - last_pos
+        last_pos = 0
+
+        # carry into the remaining positions
+        j = last - 1
+        while j >= 0:
+            pos[j] += 1
+            if pos[j] < radices[j]:
+                break
+            pos[j] = 0
+            j -= 1
+
+        # recompute the states of all changed positions
+        for k in range(max(j, 0), last):
+            buf[k] = charsets[k][pos[k]]
+            states[k + 1] = states[k].copy()
+            states[k + 1].update(symbols[k][pos[k]])
+##}}}
+
+##{{{ split keyspace into ranges
+def get_keyspace_ranges(segments, chunk_size):
+    """
+    splits the keyspace given as list of segments (each a list of charsets, one
+    per position) into index ranges (segment, start, end) over the candidate
+    numbering of generate_candidates
+    """
+    for (segment, charsets) in enumerate(segments):
+        num_candidates = get_num_candidates(charsets)
+        for start in range(0, num_candidates, chunk_size):
+            yield (segment, start, min(start + chunk_size, num_candidates))
+##}}}
+
+##{{{ lookup table
+class LookupTable(DigestIndex):
+    """
+    Precomputed digest -> password table of a keyspace: a JSON header
+    (algorithm, charset, min and max size) padded to TABLE_HEADER_SIZE bytes,
+    followed by sorted records of the digest and the password (padded with
+    zero bytes to the max size).
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            header = json.loads(f.read(TABLE_HEADER_SIZE).decode())
+        self.algorithm = header["algorithm"]
+        self.header = header
+        digest_size = HASH_ALGORITHMS[self.algorithm]().digest_size
+        DigestIndex.__init__(self, path, digest_size + header["max"],
+                TABLE_HEADER_SIZE, digest_size)
+
+    def lookup(self, digest):
+        """ returns the password of digest or None """
+        i = self.find(digest)
+        if i == -1:
+            return None
+        return self.record(i)[self.key_size:].rstrip(b'\0').decode()
+
+    def __getstate__(self):
+        return self.path
+
+    def __setstate__(self, state):
+        self.__init__(state)
+
+
+def build_table_range(job):
+    """
+    computes the records (digest + password) of all candidates of the index
+    range (segment, start, end), writes them sorted to a temporary file and
+    returns (path, pid, number of candidates, weight of the job, seconds)
+    """
+    (segment, start, end) = job
+    begin = time.time()
+
+    charsets = worker_options["segments"][segment]
+    new = HASH_ALGORITHMS[worker_options["algorithm"]]
+    size = worker_options["max"]
+
+    records = [new(curr).digest() + bytes(curr).ljust(size, b'\0')
+            for curr in generate_candidates(charsets, start, end)]
+    records.sort()
+
+    (fd, path) = tempfile.mkstemp(dir=worker_options["dir"])
+    with os.fdopen(fd, 'wb') as f:
+        f.write(b''.join(records))
+
+    return (path, os.getpid(), end - start, end - start, time.time() - begin)
+
+
+def get_table_header(algorithm, charset, min_size, max_size):
+    """
+    returns the header of a LookupTable (ends with a newline, padded to
+    TABLE_HEADER_SIZE bytes); raises a ValueError if the JSON header does not
+    fit into TABLE_HEADER_SIZE bytes
+    """
+    header = json.dumps({"algorithm": algorithm,
+        "charset": charset.decode(), "min": min_size, "max": max_size}).encode()
+
+    if len(header) > TABLE_HEADER_SIZE - 1:
+        raise ValueError("table header exceeds " + str(TABLE_HEADER_SIZE) +
+                " bytes (charset too long)")
+
+    return header.ljust(TABLE_HEADER_SIZE - 1) + b'\n'
+
+
+def build_table(path, algorithm, charset, min_size, max_size, processes,
+        progress=None):
+    """
+    Computes the digests of all passwords of size min_size to max_size once
+    and writes them as LookupTable to path. Sorted runs of the keyspace are
+    computed by a pool of worker processes and merged afterwards, so the table
+    never has to fit into memory.
+    """
+    header = get_table_header(algorithm, charset, min_size, max_size)
+    segments = [[charset] * size for size in range(min_size, max_size + 1)]
+    jobs = get_keyspace_ranges(segments, TABLE_RUN_SIZE)
+    total = sum(get_num_candidates(charsets) for charsets in segments)
+    options = {"segments": segments, "algorithm": algorithm, "max": max_size,
+            "dir": os.path.dirname(os.path.abspath(path))}
+
+    if progress is None:
+        progress = Progress()
+    progress.start(total, 1)
+
+    print("Starting {0} worker processes\n".format(processes))
+
+    runs = []
+    pool = multiprocessing.Pool(processes, init_worker, ({}, options))
+    try:
+        for (run, pid, tested, weight, seconds) in \
+                pool.imap_unordered(build_table_range, jobs):
+            runs.append(run)
+            progress.add(pid, weight, tested, 0, seconds)
+            progress.report()
+        pool.close()
+        pool.join()
+        progress.report(force=True)
+
+        record_size = HASH_ALGORITHMS[algorithm]().digest_size + max_size
+
+        files = [open(run, 'rb') for run in runs]
+        with open(path, 'wb') as out:
+            out.write(header)
+            for record in heapq.merge(*[read_records(f, record_size)
+                    for f in files]):
+                out.write(record)
+        for f in files:
+            f.close()
+    finally:
+        pool.terminate()
+        for run in runs:
+            os.remove(run)
+
+
+def table_lookup(hashes, table):
+    """
+    Resolves the hashes (unsalted ones of the table's algorithm) by binary
+    search in a LookupTable. Returns a dictionary mapping (group, digest) to
+    the password.
+    """
+    found = {}
+
+    for group in sorted(hashes):
+        (algorithm, salt) = group
+        if salt or algorithm != table.algorithm:
+            error("Skipping " + str(len(hashes[group])) + " hashes (" +
+                    algorithm + (", salted" if salt else "") +
+                    "), table contains " + table.algorithm + "\n")
+            continue
+        for d in hashes[group]:
+            pw = table.lookup(d)
+            if pw is not None:
+                found[(group, d)] = pw
+                print("Passwort: " + pw)
+                print("Hashwert: " + format_hash(group, d))
+
+    return found
+##}}}
+
+##{{{ wordlist
+def get_wordlist_ranges(path, chunk_size):
+    """
+    splits a wordlist into byte ranges (start, end); a range contains all words
+    whose line starts within the range
+    """
+    size = os.path.getsize(path)
+    for start in range(0, size, chunk_size):
+        yield (start, min(start + chunk_size, size))
+
+
+def read_wordlist_range(path, start, end):
+    """
+    yields the words (bytes) of all lines starting within the byte range start
+    to end - 1 of a wordlist. The file is memory-mapped, so only the pages of
+    the range are read and a wordlist never has to fit into memory.
+    """
+    with open(path, 'rb') as f:
+        if not os.path.getsize(path):
+            return
+        m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            pos = start
+            # skip the line which started in the previous range
+            if pos > 0 and m[pos - 1:pos] != b'\n':
+                pos = m.find(b'\n', pos) + 1
+                if pos == 0:
+                    return
+
+            while pos < end:
+                nl = m.find(b'\n', pos)
+                if nl == -1:
+                    nl = len(m)
+                word = m[pos:nl].rstrip(b'\r')
+                if word:
+                    yield word
+                pos = nl + 1
+        finally:
+            m.close()
+##}}}
+
+##{{{ rules
+def get_translation_table(mapping):
+    """ returns a bytes.translate table replacing the keys by their values """
+    table = bytearray(range(256))
+    for (c, r) in mapping:
+        table[ord(c)] = ord(r)
+    return bytes(table)
+
+LEET_TABLE = get_translation_table([('a', '4'), ('e', '3'), ('i', '1'),
+    ('o', '0'), ('s', '5'), ('t', '7')])
+DIGITS = [str(i).encode() for i in range(10)]
+
+# each rule maps a word to an iterable of transformed words
+RULES = {
+    ":": lambda w: (w,),
+    "lower": lambda w: (w.lower(),),
+    "upper": lambda w: (w.upper(),),
+    "capitalize": lambda w: (w.capitalize(),),
+    "toggle": lambda w: (w.swapcase(),),
+    "reverse": lambda w: (w[::-1],),
+    "digits": lambda w: (w + d for d in DIGITS),
+    "leet": lambda w: (w.translate(LEET_TABLE),),
+}
+
+
+def parse_rule(name):
+    """
+    returns the rule of a given name (see RULES, append:<s> and prepend:<s>),
+    raises a ValueError for unknown rules
+    """
+    if name.startswith("append:"):
+        suffix = name[len("append:"):].encode('utf-8')
+        return lambda w: (w + suffix,)
+    if name.startswith("prepend:"):
+        prefix = name[len("prepend:"):].encode('utf-8')
+        return lambda w: (prefix + w,)
+    if name in RULES:
+        return RULES[name]
+
+    raise ValueError("unknown rule '" + name + "'")
+
+
+def parse_rules(rules):
+    """
+    converts a comma separated list of rule chains (rules joined by '+') into a
+    list of chains
+    """
+    return [[parse_rule(name) for name in chain.split('+')]
+            for chain in rules.split(',')]
+
+
+def apply_chain(words, chain):
+    """ lazily applies all rules of a chain to an iterable of words """
+    if not chain:
+        return words
+    return apply_chain((r for w in words for r in chain[0](w)), chain[1:])
+
+
+def apply_rules(word, rules):
+    """ yields the candidates produced by every rule chain for a word """
+    for chain in rules:
+        for candidate in apply_chain((word,), chain):
+            yield candidate
+##}}}
+
+##{{{ worker process
+def init_worker(hashes, options):
+    """
+    stores the target hashes and the options once per worker process instead of
+    sending them along with every range
+    """
+    global worker_hashes
+    global worker_options
+    worker_hashes = hashes
+    worker_options = options
+
+
+def get_base_states(hashes):
+    """
+    returns the list of (group, hash object fed with the salt, digests) for all
+    groups (algorithm, salt) of the target hashes
+    """
+    states = []
+
+    for (algorithm, salt) in sorted(hashes):
+        base = HASH_ALGORITHMS[algorithm]()
+        base.update(salt.encode('utf-8'))
+        states.append(((algorithm, salt), base, hashes[(algorithm, salt)]))
+
+    return states
+
+
+def use_prefix_hashes(group, base, size):
+    """
+    tells whether the candidates of size characters are hashed with
+    walk_prefix_hashes for a group (algorithm, salt): only if the salt and the
+    prefix of a candidate (all but its last character) fill at least one
+    block of the algorithm, otherwise sharing prefix states saves no work
+    """
+    salt_size = len(group[1].encode('utf-8'))
+    return salt_size + size - 1 >= base.block_size
+
+
+def crack_range(job):
+    """
+    tests all candidates of the index range (segment, start, end) and returns
+    the list of (password, group, digest) pairs found and the number of
+    candidates tested
+    """
+    (segment, start, end) = job
+
+    hits = []
+    charsets = worker_options["segments"][segment]
+    states = []
+
+    for (group, base, digests) in get_base_states(worker_hashes):
+        if not use_prefix_hashes(group, base, len(charsets)):
+            states.append((group, base, digests))
+            continue
+        for (curr, h) in walk_prefix_hashes(charsets, start, end, base):
+            d = h.digest()
+            if d in digests:
+                hits.append((curr.decode(), group, d))
+
+    for curr in generate_candidates(charsets, start, end):
+        for (group, base, digests) in states:
+            h = base.copy()
+            h.update(curr)
+            d = h.digest()
+            if d in digests:
+                hits.append((curr.decode(), group, d))
+
+    return (hits, end - start)
+
+
+def crack_wordlist_range(job):
+    """
+    tests all candidates produced by the rules for the words of the wordlist
+    byte range (start, end) and returns the list of (password, group, digest)
+    pairs found and the number of candidates tested
+    """
+    (start, end) = job
+
+    hits = []
+    tested = 0
+    rules = parse_rules(worker_options["rules"])
+    states = get_base_states(worker_hashes)
+
+    for word in read_wordlist_range(worker_options["wordlist"], start, end):
+        for curr in apply_rules(word, rules):
+            tested += 1
+            for (group, base, digests) in states:
+                h = base.copy()
+                h.update(curr)
+                d = h.digest()
+                if d in digests:
+                    hits.append((curr.decode('utf-8', 'replace'), group, d))
+
+    return (hits, tested)
+##}}}
+
+##{{{ format hash
+def format_hash(group, digest):
+    """ converts a group (algorithm, salt) and a raw digest into a hash line """
+    (algorithm, salt) = group
+    h = binascii.hexlify(digest).decode()
+
+    if salt:
+        return salt + SALT_SEPARATOR + h
+    return h
+##}}}
+
+##{{{ checkpoint
+class Checkpoint(object):
+    """
+    State of a run which is written to a small JSON file every interval
+    seconds: the numbers of all completed jobs (everything below done_below and
+    the numbers in done) and the hashes found so far. job_id describes the
+    parameters of the run, a state file of another run is never resumed.
+    """
+
+    def __init__(self, path, job_id, interval=CHECKPOINT_INTERVAL):
+        self.path = path
+        self.job_id = job_id
+        self.interval = interval
+        self.done_below = 0
+        self.done = set()
+        self.found = {}
+        self.last_save = time.time()
+
+    def load(self):
+        """
+        reads the state file, raises a ValueError if it belongs to another run
+        """
+        with open(self.path) as f:
+            state = json.load(f)
+
+        if state["job"] != self.job_id:
+            raise ValueError("checkpoint '" + self.path + "' belongs to\
+ another run")
+
+        self.done_below = state["done_below"]
+        self.done = set(state["done"])
+        for (line, algorithm, pw) in state["found"]:
+            (algorithm, salt, digest) = parse_hash(line, algorithm)
+            self.found[((algorithm, salt), digest)] = pw
+
+    def save(self):
+        """ writes the state file (atomically, via a temporary file) """
+        state = {
+            "job": self.job_id,
+            "done_below": self.done_below,
+            "done": sorted(self.done),
+            "found": [[format_hash(group, d), group[0], self.found[(group, d)]]
+                for (group, d) in sorted(self.found)],
+        }
+
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.rename(tmp_path, self.path)
+        self.last_save = time.time()
+
+    def is_done(self, n):
+        return n < self.done_below or n in self.done
+
+    def complete(self, n, hits):
+        """
+        marks job n as completed, stores its hits and saves the state if the
+        interval has passed
+        """
+        for (pw, group, d) in hits:
+            self.found[(group, d)] = pw
+
+        self.done.add(n)
+        while self.done_below in self.done:
+            self.done.remove(self.done_below)
+            self.done_below += 1
+
+        if time.time() - self.last_save >= self.interval:
+            self.save()
+##}}}
+
+##{{{ progress
+def format_duration(seconds):
+    """ formats a number of seconds as h:mm:ss """
+    seconds = int(seconds)
+    return "{0}:{1:02d}:{2:02d}".format(seconds // 3600, seconds // 60 % 60,
+            seconds % 60)
+
+
+class Progress(object):
+    """
+    Counters of a run: candidates tested and busy time per worker process and
+    the part of the keyspace done (jobs weigh end - start, i.e. candidates or
+    wordlist bytes). A status line is written to stderr every interval seconds
+    and, if stats_path is given, the same numbers are appended to it as JSON
+    lines. Counters are only changed under a lock, since skipped jobs are
+    counted by the task feeder thread of the pool.
+    """
+
+    def __init__(self, interval=STATUS_INTERVAL, stats_path=None):
+        self.interval = interval
+        self.stats_path = stats_path
+        self.lock = threading.Lock()
+        self.start(0, 1)
+
+    def start(self, total, num_groups):
+        """ resets the counters for a keyspace of size total """
+        with self.lock:
+            self.total = total
+            self.num_groups = num_groups
+            self.done = 0
+            self.skipped = 0
+            self.candidates = 0
+            self.hits = 0
+            self.workers = {}
+            self.start_time = time.time()
+            self.last_report = self.start_time
+
+    def skip(self, weight):
+        """ counts a job completed by an earlier run """
+        with self.lock:
+            self.done += weight
+            self.skipped += weight
+
+    def add(self, pid, weight, tested, hits, seconds):
+        """ counts a job completed by worker pid """
+        with self.lock:
+            self.done += weight
+            self.candidates += tested
+            self.hits += hits
+            (w_tested, w_seconds) = self.workers.get(pid, (0, 0.0))
+            self.workers[pid] = (w_tested + tested, w_seconds + seconds)
+
+    def get_stats(self):
+        """ returns the current numbers of the run as dictionary """
+        with self.lock:
+            elapsed = max(time.time() - self.start_time, 1e-9)
+            rate = (self.done - self.skipped) / elapsed
+            eta = None
+            if rate > 0:
+                eta = (self.total - self.done) / rate
+
+            workers = {}
+            for (pid, (tested, seconds)) in self.workers.items():
+                workers[str(pid)] = {
+                    "candidates": tested,
+                    "hashes_per_sec": tested * self.num_groups /
+                        max(seconds, 1e-9),
+                }
+
+            return {
+                "time": time.time(),
+                "elapsed": elapsed,
+                "candidates": self.candidates,
+                "hashes_per_sec": self.candidates * self.num_groups / elapsed,
+                "percent": 100.0 * self.done / self.total if self.total else 100.0,
+                "eta": eta,
+                "found": self.hits,
+                "workers": workers,
+            }
+
+    def report(self, force=False):
+        """ publishes the current numbers if the interval has passed """
+        if not force and time.time() - self.last_report < self.interval:
+            return
+        self.last_report = time.time()
+
+        stats = self.get_stats()
+        eta = "-"
+        if stats["eta"] is not None:
+            eta = format_duration(stats["eta"])
+        workers = ", ".join("{0}: {1:.0f} H/s".format(pid,
+                stats["workers"][pid]["hashes_per_sec"])
+                for pid in sorted(stats["workers"]))
+
+        error("[{0:6.2f}%] {1} candidates, {2:.0f} H/s, found {3}, elapsed {4},\
+ ETA {5} ({6})\n".format(stats["percent"], stats["candidates"],
+            stats["hashes_per_sec"], stats["found"],
+            format_duration(stats["elapsed"]), eta, workers))
+
+        if self.stats_path:
+            with open(self.stats_path, 'a') as f:
+                f.write(json.dumps(stats, sort_keys=True) + '\n')
+##}}}
+
+##{{{ run workers
+def run_job(task):
+    """
+    runs a single job (n, crack_func, job) and returns (n, pid, hits, number of
+    candidates tested, weight of the job, seconds)
+    """
+    (n, crack_func, job) = task
+    start = time.time()
+    (hits, tested) = crack_func(job)
+    return (n, os.getpid(), hits, tested, job[-1] - job[-2],
+            time.time() - start)
+
+
+def prepare_targets(hashes, checkpoint=None):
+    """
+    returns (found, remaining, targets, num_of_hashes) of a run: found maps
+    (group, digest) to the password (including the hashes of the checkpoint),
+    remaining contains the digest sets with the found digests removed (an
+    index file is read-only and kept as is), targets maps every group to the
+    digests the workers still have to search
+    """
+    found = {}
+    # found digests are removed from the sets; an index file is read-only
+    remaining = dict((group, set(hashes[group])) for group in hashes
+            if isinstance(hashes[group], set))
+    num_of_hashes = sum(len(hashes[group]) for group in hashes)
+
+    if checkpoint:
+        record_hits(found, remaining, [(pw, group, d)
+            for ((group, d), pw) in checkpoint.found.items()])
+
+    targets = dict(hashes)
+    targets.update(remaining)
+
+    return (found, remaining, targets, num_of_hashes)
+
+
+def record_hits(found, remaining, hits):
+    """
+    stores and prints all hits (password, group, digest) which are not found
+    yet and removes them from remaining; returns the number of new hits
+    """
+    num_found = len(found)
+
+    for (pw, group, d) in hits:
+        if (group, d) not in found:
+            found[(group, d)] = pw
+            if group in remaining:
+                remaining[group].discard(d)
+            print("Passwort: " + pw)
+            print("Hashwert: " + format_hash(group, d))
+
+    return len(found) - num_found
+
+
+def run_workers(hashes, crack_func, jobs, total, options, processes,
+        checkpoint=None, progress=None):
+    """
+    distributes the jobs over a pool of worker processes running crack_func and
+    collects the (password, hash) pairs found until all hashes are found or all
+    jobs are done. total is the size of the keyspace (sum of end - start over
+    all jobs) and the progress is reported to progress (see Progress). If a
+    checkpoint is given, the jobs and hashes it already contains are skipped
+    and the progress is saved to it. Returns a dictionary mapping (group,
+    digest) to the password.
+    """
+    # workers only get the hashes which are not found yet
+    (found, remaining, targets, num_of_hashes) = prepare_targets(hashes,
+            checkpoint)
+
+    if not num_of_hashes or len(found) == num_of_hashes:
+        return found
+
+    if progress is None:
+        progress = Progress()
+    progress.start(total, len(targets))
+
+    def get_tasks():
+        for (n, job) in enumerate(jobs):
+            if checkpoint and checkpoint.is_done(n):
+                progress.skip(job[-1] - job[-2])
+            else:
+                yield (n, crack_func, job)
+
+    print("Starting {0} worker processes\n".format(processes))
+
+    pool = multiprocessing.Pool(processes, init_worker, (targets, options))
+    try:
+        results = pool.imap_unordered(run_job, get_tasks())
+        while True:
+            try:
+                (n, pid, hits, tested, weight, seconds) = \
+                        results.next(progress.interval)
+            except multiprocessing.TimeoutError:
+                progress.report()
+                continue
+            except StopIteration:
+                break
+
+            num_new = record_hits(found, remaining, hits)
+            progress.add(pid, weight, tested, num_new, seconds)
+            progress.report()
+            if checkpoint:
+                checkpoint.complete(n, hits)
+            if len(found) == num_of_hashes:
+                break
+    finally:
+        pool.terminate()
+        pool.join()
+        progress.report(force=True)
+        if checkpoint:
+            checkpoint.save()
+
+    return found
+##}}}
+
+##{{{ distributed cracking (coordinator and remote workers)
+def send_message(sock, message):
+    """ sends a message (dictionary) as JSON line """
+    sock.sendall((json.dumps(message) + '\n').encode())
+
+
+def encode_charsets(segments):
+    return [[bytes(c).decode('latin-1') for c in charsets]
+            for charsets in segments]
+
+
+def decode_charsets(segments):
+    return [[bytearray(c.encode('latin-1')) for c in charsets]
+            for charsets in segments]
+
+
+class Coordinator(object):
+    """
+    State shared by all connections of the coordinator: the jobs not handed out
+    yet, the jobs of lost workers (handed out again first), the jobs currently
+    assigned and the hashes found. All methods are called under a lock by the
+    connection threads.
+    """
+
+    def __init__(self, hashes, jobs, total, options, checkpoint, progress):
+        self.lock = threading.Lock()
+        self.finished = threading.Event()
+        self.checkpoint = checkpoint
+        self.progress = progress
+        self.jobs = enumerate(jobs)
+        self.requeued = []
+        self.assigned = {}
+
+        (self.found, self.remaining, targets, self.num_of_hashes) = \
+                prepare_targets(hashes, checkpoint)
+        progress.start(total, len(targets))
+
+        self.setup = {
+            "type": "setup",
+            "hashes": [[group[0], group[1],
+                [binascii.hexlify(d).decode() for d in targets[group]]]
+                for group in sorted(targets)],
+            "segments": encode_charsets(options["segments"]),
+        }
+
+        if not self.num_of_hashes or len(self.found) == self.num_of_hashes:
+            self.finished.set()
+
+    def next_job(self):
+        """
+        returns the next message for a worker: a job, 'wait' (all jobs are
+        assigned, but a worker may still be lost) or 'done'
+        """
+        with self.lock:
+            if self.finished.is_set():
+                return {"type": "done"}
+
+            if self.requeued:
+                (n, job) = self.requeued.pop()
+                self.assigned[n] = job
+                return {"type": "job", "n": n, "job": list(job)}
+
+            for (n, job) in self.jobs:
+                if self.checkpoint and self.checkpoint.is_done(n):
+                    self.progress.skip(job[-1] - job[-2])
+                    continue
+                self.assigned[n] = job
+                return {"type": "job", "n": n, "job": list(job)}
+
+            if self.assigned:
+                return {"type": "wait"}
+
+            self.finished.set()
+            return {"type": "done"}
+
+    def complete(self, n, worker, hits, tested, seconds):
+        """ stores the result of job n of a worker """
+        with self.lock:
+            if n not in self.assigned:
+                return
+            job = self.assigned.pop(n)
+
+            num_new = record_hits(self.found, self.remaining, hits)
+            self.progress.add(worker, job[-1] - job[-2], tested, num_new,
+                    seconds)
+            if self.checkpoint:
+                self.checkpoint.complete(n, hits)
+
+            if len(self.found) == self.num_of_hashes:
+                self.finished.set()
+
+    def release(self, worker, jobs):
+        """ hands out the jobs of a lost worker again """
+        with self.lock:
+            lost = [n for n in jobs if n in self.assigned]
+            for n in lost:
+                self.requeued.append((n, self.assigned.pop(n)))
+            if lost and not self.finished.is_set():
+                error("Lost worker " + worker + ", reassigning " +
+                        str(len(lost)) + " ranges\n")
+
+
+class CoordinatorHandler(socketserver.StreamRequestHandler):
+    """
+    Connection of a remote worker. Any message counts as heartbeat; if none
+    arrives for WORKER_TIMEOUT seconds or the connection breaks, the jobs of
+    the worker are handed out again.
+    """
+
+    def handle(self):
+        coordinator = self.server.coordinator
+        worker = "{0}:{1}".format(*self.client_address)
+        jobs = set()
+        self.request.settimeout(WORKER_TIMEOUT)
+
+        try:
+            while True:
+                line = self.rfile.readline()
+                if not line:
+                    break
+                message = json.loads(line.decode())
+
+                if message["type"] == "hello":
+                    worker = message["worker"]
+                    send_message(self.request, coordinator.setup)
+                    continue
+                if message["type"] == "result":
+                    hits = [(pw, (algorithm, salt), binascii.unhexlify(d))
+                            for (pw, algorithm, salt, d) in message["hits"]]
+                    coordinator.complete(message["n"], worker, hits,
+                            message["tested"], message["seconds"])
+                    jobs.discard(message["n"])
+                if message["type"] in ["request", "result"]:
+                    reply = coordinator.next_job()
+                    if reply["type"] == "job":
+                        jobs.add(reply["n"])
+                    send_message(self.request, reply)
+        except (socket.error, ValueError, KeyError):
+            pass
+        finally:
+            coordinator.release(worker, jobs)
+
+
+def serve_workers(hashes, jobs, total, options, address, checkpoint=None,
+        progress=None):
+    """
+    Coordinator: hands out the index ranges of the jobs and the target hashes
+    to remote workers (see run_remote_worker) connecting via TCP to address,
+    collects their hits and reassigns the ranges of lost workers. Returns a
+    dictionary mapping (group, digest) to the password.
+    """
+    if progress is None:
+        progress = Progress()
+
+    coordinator = Coordinator(hashes, jobs, total, options, checkpoint,
+            progress)
+
+    socketserver.ThreadingTCPServer.allow_reuse_address = True
+    server = socketserver.ThreadingTCPServer(address, CoordinatorHandler)
+    server.daemon_threads = True
+    server.coordinator = coordinator
+
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    print("Waiting for workers on {0}:{1}\n".format(*server.server_address))
+
+    try:
+        while not coordinator.finished.wait(progress.interval):
+            progress.report()
+    finally:
+        server.shutdown()
+        server.server_close()
+        progress.report(force=True)
+        if checkpoint:
+            with coordinator.lock:
+                checkpoint.save()
+
+    return coordinator.found
+
+
+def run_remote_worker(address):
+    """
+    Remote worker: connects to a coordinator, receives the target hashes and
+    cracks the ranges handed out with crack_range until the coordinator is
+    done. A thread sends heartbeats while a range is cracked.
+    """
+    sock = socket.create_connection(address)
+    f = sock.makefile('rb')
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def send(message):
+        with lock:
+            send_message(sock, message)
+
+    def heartbeat():
+        while not stop.wait(HEARTBEAT_INTERVAL):
+            try:
+                send({"type": "heartbeat"})
+            except socket.error:
+                return
+
+    try:
+        worker = "{0}:{1}".format(socket.gethostname(), os.getpid())
+        send({"type": "hello", "worker": worker})
+        setup = json.loads(f.readline().decode())
+
+        hashes = {}
+        for (algorithm, salt, digests) in setup["hashes"]:
+            hashes[(algorithm, salt)] = set(binascii.unhexlify(d)
+                    for d in digests)
+        init_worker(hashes, {"segments": decode_charsets(setup["segments"])})
+
+        thread = threading.Thread(target=heartbeat)
+        thread.daemon = True
+        thread.start()
+
+        send({"type": "request"})
+        while True:
+            line = f.readline()
+            if not line:
+                break
+            message = json.loads(line.decode())
+            if message["type"] == "done":
+                break
+            if message["type"] == "wait":
+                time.sleep(1)
+                send({"type": "request"})
+                continue
+
+            start = time.time()
+            (hits, tested) = crack_range(tuple(message["job"]))
+            send({"type": "result", "n": message["n"], "tested": tested,
+                "seconds": time.time() - start,
+                "hits": [[pw, group[0], group[1], binascii.hexlify(d).decode()]
+                    for (pw, group, d) in hits]})
+    finally:
+        stop.set()
+        sock.close()
+
+
+def run_remote_workers(address, processes):
+    """ starts processes remote workers connecting to the coordinator """
+    workers = [multiprocessing.Process(target=run_remote_worker,
+        args=(address,)) for i in range(processes)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+def parse_address(address):
+    """ converts host:port into (host, port), raises a ValueError if invalid """
+    (host, port) = address.rsplit(':', 1)
+    return (host, int(port))
+##}}}
+
+##{{{ benchmarks
+def measure(func, num_items, repeat=BENCH_REPEAT):
+    """ returns the best rate (items per second) of repeat calls of func """
+    best = 0.0
+    for i in range(repeat):
+        start = timeit.default_timer()
+        func()
+        seconds = max(timeit.default_timer() - start, 1e-9)
+        best = max(best, num_items / seconds)
+    return best
+
+
+def run_benchmarks(num=BENCH_SIZE):
+    """
+    measures the throughput of candidate generation, hashing per algorithm,
+    digest lookup and of crack_range (end to end, one process) for several
+    charsets and password sizes. Returns a dictionary mapping the name of each
+    benchmark to its rate (items per second).
+    """
+    results = {}
+    charsets = {
+        "10": bytearray(DIGIT_RANGE),
+        "26": MASK_CHARSETS['l'],
+        "62": bytearray(list(LOWER_CASE_RANGE) + list(UPPER_CASE_RANGE) +
+            list(DIGIT_RANGE)),
+        "95": MASK_CHARSETS['a'],
+    }
+
+    def consume(iterable):
+        for item in iterable:
+            pass
+
+    # candidate generation
+    for name in sorted(charsets):
+        for size in [4, 6, 8]:
+            segment = [charsets[name]] * size
+            results["generate/charset={0}/size={1}".format(name, size)] = \
+                    measure(lambda: consume(generate_candidates(segment, 0,
+                        num)), num)
+
+    # hashing per algorithm (base state copied as in crack_range)
+    segment = [charsets["26"]] * 8
+    candidates = [bytes(c) for c in generate_candidates(segment, 0, num)]
+    for algorithm in sorted(HASH_ALGORITHMS):
+        base = HASH_ALGORITHMS[algorithm]()
+
+        def hash_all():
+            for c in candidates:
+                h = base.copy()
+                h.update(c)
+                h.digest()
+        results["hash/" + algorithm] = measure(hash_all, num)
+
+        results["prefix/" + algorithm] = measure(lambda: consume(
+            h.digest() for (c, h) in walk_prefix_hashes(segment, 0, num,
+                base)), num)
+
+    # digest lookup in a set and in an index file (half of the digests hit)
+    digests = [hashlib.sha1(c).digest() for c in candidates]
+    targets = set(digests[::2])
+    results["lookup/set"] = measure(lambda: consume(d in targets
+        for d in digests), num)
+
+    (fd, path) = tempfile.mkstemp()
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(b''.join(sorted(targets)))
+        index = DigestIndex(path, DIGEST_SIZE_SHA1)
+        results["lookup/index"] = measure(lambda: consume(d in index
+            for d in digests), num)
+        index.f.close()
+    finally:
+        os.remove(path)
+
+    # end to end
+    for name in ["26", "95"]:
+        init_worker({("sha1", ''): set([b'\0' * DIGEST_SIZE_SHA1])},
+                {"segments": [[charsets[name]] * 6]})
+        results["crack/charset={0}/size=6".format(name)] = \
+                measure(lambda: crack_range((0, 0, num)), num)
+
+    return results
+
+
+def compare_benchmarks(results, baseline, tolerance=BENCH_TOLERANCE):
+    """
+    prints the rates of all benchmarks together with the change against the
+    baseline and returns the names of all benchmarks which are more than
+    tolerance slower than in the baseline
+    """
+    regressions = []
+
+    for name in sorted(results):
+        line = "{0:32} {1:14.0f}/s".format(name, results[name])
+        if name in baseline and baseline[name] > 0:
+            change = results[name] / baseline[name] - 1
+            line += " {0:+7.1%}".format(change)
+            if change < -tolerance:
+                line += "  REGRESSION"
+                regressions.append(name)
+        print(line)
+
+    return regressions
+
+
+def benchmark(baseline_path=None, update=False):
+    """
+    runs the benchmarks and compares them to the baseline file (JSON) of an
+    earlier run. The results are written to the baseline file if it does not
+    exist yet or update is set. Returns the names of all regressions.
+    """
+    results = run_benchmarks()
+
+    baseline = {}
+    if baseline_path and os.path.exists(baseline_path):
+        with open(baseline_path) as f:
+            baseline = json.load(f)["results"]
+
+    regressions = compare_benchmarks(results, baseline)
+
+    if baseline_path and (update or not baseline):
+        with open(baseline_path, 'w') as f:
+            json.dump({"time": time.time(), "python": sys.version.split()[0],
+                "results": results}, f, indent=1, sort_keys=True)
+
+    return regressions
 ##}}}
 
 ##{{{ crack passwords
-def pw_crack(hashes, current, min_size, max_size):
+def pw_crack(hashes, charset, min_size, max_size, processes, checkpoint=None,
+        progress=None, serve=None):
     """
-    Gets an arbitrary number of hashes and checks all possible passwords of size
-    min_size to max_size (characters) until all pairs (password, hash) are found
-    or all possible passwords are tested
+    Gets an arbitrary number of hashes (a dictionary mapping (algorithm, salt)
+    to a set of raw digests or a DigestIndex) and checks all possible passwords
+    of size min_size to max_size (characters) until all pairs (password, hash)
+    are found or all possible passwords are tested. The keyspace is split into
+    index ranges which are distributed over a pool of worker processes. The
+    progress is saved to the checkpoint (see Checkpoint), if one is given, and
+    reported to progress (see Progress). If serve is given (host, port), the
+    ranges are handed out to remote workers instead (see serve_workers).
     """
-    num_of_hashes = len(hashes) - 1
+    segments = [[charset] * size for size in range(min_size, max_size + 1)]
+    jobs = get_keyspace_ranges(segments, CHUNK_SIZE)
+    total = sum(get_num_candidates(charsets) for charsets in segments)
+    options = {"segments": segments}
+
+    if serve:
+        return serve_workers(hashes, jobs, total, options, serve, checkpoint,
+                progress)
+    return run_workers(hashes, crack_range, jobs, total, options, processes,
+            checkpoint, progress)
+##}}}
 
-    threads = []
-    thread_not_full_size = thread_crack_pw(
-            "Thread 1",
-            min_size,
-            max_size - 1,
-            hashes,
-            num_of_hashes,
-            False)
-    thread_not_full_size.start()
-    threads.append(thread_not_full_size)
+##{{{ crack passwords (mask)
+def mask_crack(hashes, mask, processes, checkpoint=None, progress=None,
+        serve=None):
+    """
+    Gets an arbitrary number of hashes and checks all passwords matching the
+    mask (see parse_mask), i.e. every position has its own charset. The
+    keyspace is split into index ranges like in pw_crack.
+    """
+    segments = [parse_mask(mask)]
+    jobs = get_keyspace_ranges(segments, CHUNK_SIZE)
+    total = get_num_candidates(segments[0])
+    options = {"segments": segments}
 
-    thread_full_size = thread_crack_pw(
-            "Thread 2",
-            min_size,
-            max_size,
-            hashes,
-            num_of_hashes,
-            True)
-    thread_full_size.start()
-    threads.append(thread_full_size)
+    if serve:
+        return serve_workers(hashes, jobs, total, options, serve, checkpoint,
+                progress)
+    return run_workers(hashes, crack_range, jobs, total, options, processes,
+            checkpoint, progress)
+##}}}
 
-    for thread in threads:
-        thread.join()
+##{{{ crack passwords (wordlist)
+def wordlist_crack(hashes, wordlist, rules, processes, checkpoint=None,
+        progress=None):
+    """
+    Gets an arbitrary number of hashes and checks all candidates produced by
+    the rules (see parse_rules) for every word of the wordlist. The wordlist is
+    streamed in byte ranges which are distributed over a pool of worker
+    processes; the progress is measured in bytes of the wordlist.
+    """
+    jobs = get_wordlist_ranges(wordlist, WORDLIST_CHUNK_SIZE)
+    total = os.path.getsize(wordlist)
+    options = {"wordlist": wordlist, "rules": rules}
 
+    return run_workers(hashes, crack_wordlist_range, jobs, total, options,
+            processes, checkpoint, progress)
+##}}}
+
+##{{{ get job id
+def get_job_id(args):
+    """
+    describes all parameters that determine the jobs and hashes of a run, a
+    checkpoint is only resumed by a run with the same description
+    """
+    params = [args.mode, os.path.abspath(args.file), args.format, args.min,
+            args.max, args.charset, args.mask, args.rules, CHUNK_SIZE]
+    if args.wordlist:
+        params += [os.path.abspath(args.wordlist), WORDLIST_CHUNK_SIZE]
+
+    return repr(params)
 ##}}}
 
 ##{{{ sanitize_inputs
 def sanitize_inputs(args):
-    file_content = ""
+    file_content = {}
+
+    if args.mode not in ["build", "worker", "bench"] and not args.file:
+        error_str = "Missing input parameter, -f"
+        usage(error_str)
+
+    if args.mode == "worker" and not args.connect:
+        error_str = "Missing input parameter, --connect"
+        usage(error_str)
+
+    if args.serve and args.mode not in ["brute", "mask"]:
+        error_str = "Option --serve requires mode brute or mask"
+        usage(error_str)
+
+    for address in [args.serve, args.connect]:
+        if address:
+            try:
+                parse_address(address)
+            except ValueError:
+                error_str = "Invalid address '" + address + "' (host:port)"
+                usage(error_str)
+
+    if args.mode in ["build", "lookup"] and not args.table:
+        error_str = "Missing input parameter, -t"
+        usage(error_str)
+
+    if args.mode == "lookup" and not os.path.isfile(args.table):
+        error_str = "File '" + args.table + "' not found"
+        usage(error_str)
 
     if args.file:
         try:
             f = open(args.file)
-            file_content = read_file(f)
         except:
             error_str = "File '" + args.file + "' not found"
             usage(error_str)
+        try:
+            if args.index:
+                if not args.format:
+                    error_str = "Option --index requires --format"
+                    usage(error_str)
+                try:
+                    index = open_index(f, args.index, args.format)
+                except IOError as e:
+                    error_str = "Option --index: " + str(e)
+                    usage(error_str)
+                file_content = {(args.format, ''): index}
+            else:
+                file_content = read_file(f, args.format)
+        except ValueError as e:
+            error_str = "File '" + args.file + "' contains an " + str(e)
+            usage(error_str)
+        f.close()
+
+    if args.mode in ["brute", "build"] and args.max is None:
+        error_str = "Missing input parameter, -max"
+        usage(error_str)
+
+    if args.mode == "wordlist" and not args.wordlist:
+        error_str = "Missing input parameter, -w"
+        usage(error_str)
+
+    if args.mode == "mask":
+        if not args.mask:
+            error_str = "Missing input parameter, --mask"
+            usage(error_str)
+        try:
+            parse_mask(args.mask)
+        except ValueError as e:
+            error_str = "Invalid mask: " + str(e)
+            usage(error_str)
+
+    if args.wordlist and not os.path.isfile(args.wordlist):
+        error_str = "File '" + args.wordlist + "' not found"
+        usage(error_str)
 
     if args.min < 1:
         error_str = "Minimum password length must be a positive number"
         usage(error_str)
 
-    if args.max < args.min:
+    if args.max is not None and args.max < args.min:
         error_str = "Maximum password length must be at least equal to the\
                 minimum password length"
         usage(error_str)
 
-    return(file_content, args.min, args.max)
+    if args.processes < 1:
+        error_str = "Number of processes must be a positive number"
+        usage(error_str)
+
+    charset = bytearray()
+    for c in args.charset:
+        if ord(c) > 0x7f:
+            error_str = "Charset must only contain ASCII characters"
+            usage(error_str)
+        if ord(c) not in charset:
+            charset.append(ord(c))
+
+    if not charset:
+        error_str = "Charset must not be empty"
+        usage(error_str)
+
+    args.charset = charset
+
+    if args.mode == "build":
+        try:
+            get_table_header(args.format or "sha1", charset, args.min, args.max)
+        except ValueError as e:
+            error_str = "Invalid table: " + str(e)
+            usage(error_str)
+
+    if args.checkpoint and args.mode not in ["brute", "wordlist", "mask"]:
+        error_str = "Option --checkpoint requires mode brute, wordlist or mask"
+        usage(error_str)
+
+    if args.resume and not args.checkpoint:
+        error_str = "Option --resume requires --checkpoint"
+        usage(error_str)
+
+    if args.interval <= 0:
+        error_str = "Checkpoint interval must be a positive number"
+        usage(error_str)
+
+    if args.status_interval <= 0:
+        error_str = "Status interval must be a positive number"
+        usage(error_str)
+
+    # the rules are passed to the workers as string and parsed there
+    try:
+        parse_rules(args.rules)
+    except ValueError as e:
+        error_str = "Invalid rules: " + str(e)
+        usage(error_str)
+
+    return (file_content, args)
 ##}}}
 
 ##{{{ add parser arguments
 def add_parser_arguments(parser):
+    parser.add_argument("-m", "--mode", help="specifies the attack: brute\
+            (all passwords of size min to max), wordlist (words of a\
+            wordlist transformed by rules), mask (one charset per position),\
+            build (precompute a lookup table of size min to max), lookup\
+            (resolve hashes with a lookup table), worker (crack ranges\
+            handed out by a coordinator) or bench (measure the throughput)",
+            type=str, choices=["brute", "wordlist", "mask", "build", "lookup",
+                "worker", "bench"], default="brute")
     parser.add_argument("-f", "--file", help="specifies the path to the input\
-            file", type=str, required=True)
+            file", type=str, required=False)
+    parser.add_argument("-t", "--table", help="specifies the path to the\
+            lookup table", type=str)
+    parser.add_argument("-i", "--index", help="sorted digest index file for\
+            large hash files (built from the input file if it does not\
+            exist or belongs to another hash file)", type=str)
+    parser.add_argument("--format", help="hash algorithm of all hashes\
+            (default: detected by the length of each hash)", type=str,
+            choices=sorted(HASH_ALGORITHMS))
     parser.add_argument("-min", help="minimum password size", type=int,
-            required=True)
+            default=1)
     parser.add_argument("-max", help="maximum password size", type=int,
-            required=True)
+            required=False)
+    parser.add_argument("-c", "--charset", help="characters used for the\
+            password candidates (default: a-z)", type=str,
+            default="".join(chr(i) for i in LOWER_CASE_RANGE))
+    parser.add_argument("--mask", help="mask of the passwords, e.g.\
+            ?u?l?l?l?d?d (?l, ?u, ?d, ?s, ?a, ?? or literal characters)",
+            type=str)
+    parser.add_argument("-w", "--wordlist", help="specifies the path to the\
+            wordlist (one word per line)", type=str)
+    parser.add_argument("-r", "--rules", help="comma separated rule chains\
+            applied to every word (default: ':', the word itself)", type=str,
+            default=":")
+    parser.add_argument("--checkpoint", help="state file the progress is\
+            saved to periodically", type=str)
+    parser.add_argument("--resume", help="resume the run saved in the\
+            checkpoint file (skips completed ranges and found hashes)",
+            action="store_true")
+    parser.add_argument("--interval", help="seconds between two checkpoints\
+            (default: " + str(CHECKPOINT_INTERVAL) + ")", type=int,
+            default=CHECKPOINT_INTERVAL)
+    parser.add_argument("--status-interval", help="seconds between two\
+            status reports on stderr (default: " + str(STATUS_INTERVAL) + ")",
+            type=int, default=STATUS_INTERVAL)
+    parser.add_argument("--stats", help="file the status reports are\
+            appended to as JSON lines", type=str)
+    parser.add_argument("--serve", help="act as coordinator on host:port\
+            and hand out the ranges to remote workers (brute and mask)",
+            type=str)
+    parser.add_argument("--connect", help="host:port of the coordinator\
+            (worker mode)", type=str)
+    parser.add_argument("--baseline", help="JSON file with the benchmark\
+            results of an earlier run (written if it does not exist)",
+            type=str)
+    parser.add_argument("--update", help="overwrite the baseline with the\
+            current benchmark results", action="store_true")
+    parser.add_argument("-p", "--processes", help="number of worker\
+            processes (default: number of cores)", type=int,
+            default=multiprocessing.cpu_count())
 
     return parser.parse_args()
 ##}}}
@@ -201,15 +1871,52 @@ def main():
 
     args = add_parser_arguments(parser)
 
-    (file_content, pw_size_min, pw_size_max) = sanitize_inputs(args)
+    (file_content, args) = sanitize_inputs(args)
+
+    if args.mode == "worker":
+        run_remote_workers(parse_address(args.connect), args.processes)
+        return
+
+    if args.mode == "bench":
+        if benchmark(args.baseline, args.update):
+            sys.exit(1)
+        return
+
+    serve = None
+    if args.serve:
+        serve = parse_address(args.serve)
+
+    checkpoint = None
+    if args.checkpoint:
+        checkpoint = Checkpoint(args.checkpoint, get_job_id(args), args.interval)
+        if args.resume and os.path.exists(args.checkpoint):
+            try:
+                checkpoint.load()
+            except (ValueError, KeyError) as e:
+                error_str = "Can not resume: " + str(e)
+                usage(error_str)
+
+    progress = Progress(args.status_interval, args.stats)
 
     digits = 3
-    start = time.clock()
-    print(file_content)
-    #pw_crack(file_content, [], 1, len(file_content))
-    pw_crack(file_content, [], pw_size_min, pw_size_max)
-    end = time.clock()
-    print("required time: {0} ms".format(round(end - start,digits)))
+    # wall clock time; the cpu time of the parent says nothing about workers
+    start = time.time()
+    if args.mode == "brute":
+        pw_crack(file_content, args.charset, args.min, args.max,
+                args.processes, checkpoint, progress, serve)
+    elif args.mode == "wordlist":
+        wordlist_crack(file_content, args.wordlist, args.rules, args.processes,
+                checkpoint, progress)
+    elif args.mode == "mask":
+        mask_crack(file_content, args.mask, args.processes, checkpoint,
+                progress, serve)
+    elif args.mode == "build":
+        build_table(args.table, args.format or "sha1", args.charset, args.min,
+                args.max, args.processes, progress)
+    elif args.mode == "lookup":
+        table_lookup(file_content, LookupTable(args.table))
+    end = time.time()
+    print("required time: {0} s".format(round(end - start,digits)))
 
 # }}}
 
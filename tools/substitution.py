@@ -9,9 +9,41 @@ __version__ = 1.0
 import sys
 import re
 import argparse
+import array
+import multiprocessing
+import random
+from math import log10, exp
 
 alphabet = "abcdefghijklmnopqrstuvwxyz"
 
+# the quadgram table holds the log10 probability of every quadgram at the
+# index a*26^3 + b*26^2 + c*26 + d; unseen quadgrams get the probability of
+# UNSEEN_COUNT occurrences
+NUM_QUADGRAMS = 26 ** 4
+UNSEEN_COUNT  = 0.01
+
+# defaults of the solver: number of climbs per round, number of consecutive
+# swaps without improvement after which a climb stops, number of climbs
+# that have to reach the best score before the solver stops and number of
+# climbs after which it gives up; short ciphertexts of a few hundred letters
+# usually need several rounds
+RESTARTS     = 8
+ITERATIONS   = 2000
+AGREEMENT    = 3
+MAX_RESTARTS = 200
+
+# simulated annealing of a climb: a swap that lowers the score by d is kept
+# with probability exp(-d / temperature), the temperature starts at
+# START_TEMPERATURE and is multiplied by COOLING after every swap; scores
+# closer than SCORE_TOLERANCE count as the same
+START_TEMPERATURE = 50.0
+COOLING           = 0.9997
+SCORE_TOLERANCE   = 1e-6
+
+# quadgram table and ciphertext (letter indices) of a solver process
+worker_table  = None
+worker_cipher = None
+
 ##{{{ error and usage
 def error(message):
     """ Prints error message."""
@@ -31,12 +63,14 @@ def usage(message):
     error(usage_str)
     print
     print("-----------------------------------------------------------------------------")
-    print("possible modes [encrypt, decrypt, analyze, replace]")
+    print("possible modes [encrypt, decrypt, analyze, replace, pattern, solve]")
     print("encrypt   - encrypt a given text in a file and print the ciphertext")
     print("decrypt   - decrypt a given text in a file and print the plaintext")
     print("analyze   - print character frequency")
     print("replace   - replace individual characters")
     print("pattern   - searches for a given string pattern")
+    print("solve     - find the key by hill-climbing with quadgram scores")
+    print("            (--quadgrams: file with lines '<quadgram> <count>')")
     print("file      - contains the plaintext")
     print("-----------------------------------------------------------------------------")
     exit(1)
@@ -163,18 +197,189 @@ def replace(ciphertext, args_dict):
     return result
 ##}}}
 
+##{{{ solve
+def read_quadgrams(f):
+    """
+    reads a file f of quadgram counts (lines '<quadgram> <count>', e.g.
+    'TION 13168375') and returns the quadgram table (flat array of the log10
+    probabilities)
+    """
+    counts = {}
+
+    for line in f:
+        fields = line.split()
+        if len(fields) != 2 or len(fields[0]) != 4:
+            continue
+        quadgram = fields[0].lower()
+        if any(c not in alphabet for c in quadgram):
+            continue
+        index = 0
+        for c in quadgram:
+            index = index * 26 + alphabet.index(c)
+        counts[index] = counts.get(index, 0) + int(fields[1])
+
+    total = float(sum(counts.values()))
+    if not total:
+        raise ValueError("no quadgrams found")
+
+    table = array.array('d', [log10(UNSEEN_COUNT / total)]) * NUM_QUADGRAMS
+    for (index, count) in counts.items():
+        table[index] = log10(count / total)
+
+    return table
+
+
+def score_positions(plain, positions, table):
+    """
+    returns the sum of the quadgram scores of the plaintext (letter indices)
+    at the given start positions
+    """
+    score = 0.0
+    for i in positions:
+        score += table[((plain[i] * 26 + plain[i + 1]) * 26 + plain[i + 2])
+                * 26 + plain[i + 3]]
+    return score
+
+
+def init_worker(table, cipher):
+    global worker_table, worker_cipher
+
+    worker_table  = table
+    worker_cipher = cipher
+
+
+def climb(job):
+    """
+    Climbs from a random key (job: seed, iterations) over the keys of the
+    ciphertext of the worker: two letters of the key are swapped and the swap
+    is kept if the quadgram score of the plaintext improves or, while the
+    temperature is high, by chance (simulated annealing). Only the quadgrams
+    containing one of the two swapped ciphertext letters are scored again. A
+    climb stops after iterations swaps without improvement and returns the
+    best (score, key) it passed.
+    """
+    (seed, iterations) = job
+
+    table  = worker_table
+    cipher = worker_cipher
+    rand   = random.Random(seed)
+
+    # positions of each ciphertext letter and the start positions of the
+    # quadgrams containing a pair of letters (built on demand)
+    occurrences = [[] for _ in alphabet]
+    for (i, c) in enumerate(cipher):
+        occurrences[c].append(i)
+    num_quadgrams = max(0, len(cipher) - 3)
+    affected = {}
+
+    # mapping of ciphertext letters to plaintext letters
+    mapping = list(range(26))
+    rand.shuffle(mapping)
+    plain = [mapping[c] for c in cipher]
+    score = score_positions(plain, range(num_quadgrams), table)
+
+    best_score   = score
+    best_mapping = list(mapping)
+    temperature  = START_TEMPERATURE
+
+    stall = 0
+    while stall < iterations:
+        (x, y) = sorted(rand.sample(range(26), 2))
+
+        if (x, y) not in affected:
+            affected[(x, y)] = sorted(set(i for pos in occurrences[x] +
+                occurrences[y] for i in range(max(0, pos - 3),
+                    min(pos + 1, num_quadgrams))))
+        positions = affected[(x, y)]
+
+        old_score = score_positions(plain, positions, table)
+        for i in occurrences[x]:
+            plain[i] = mapping[y]
+        for i in occurrences[y]:
+            plain[i] = mapping[x]
+        delta = score_positions(plain, positions, table) - old_score
+
+        if delta > 0 or (temperature > 0 and
+                rand.random() < exp(delta / temperature)):
+            (mapping[x], mapping[y]) = (mapping[y], mapping[x])
+            score += delta
+            if score > best_score:
+                best_score   = score
+                best_mapping = list(mapping)
+        else:
+            for i in occurrences[x]:
+                plain[i] = mapping[x]
+            for i in occurrences[y]:
+                plain[i] = mapping[y]
+
+        stall = 0 if delta > 0 else stall + 1
+        temperature *= COOLING
+
+    # key in the format of encrypt/decrypt: ciphertext letter of each
+    # plaintext letter
+    key = [None] * 26
+    for (c, p) in enumerate(best_mapping):
+        key[p] = alphabet[c]
+
+    return (best_score, "".join(key))
+
+
+def solve(c, table, restarts=RESTARTS, iterations=ITERATIONS, processes=None,
+        seed=0, agreement=AGREEMENT, max_restarts=MAX_RESTARTS):
+    """
+    runs rounds of restarts independent climbs on the ciphertext c in a pool
+    of processes until agreement climbs reached the best score (or
+    max_restarts climbs ran) and returns the best (score, key)
+    """
+    cipher = [alphabet.index(ch) for ch in c if ch in alphabet]
+
+    results = []
+    pool = multiprocessing.Pool(processes, init_worker, (table, cipher))
+    try:
+        while len(results) < max(restarts, max_restarts):
+            results += pool.map(climb, [(seed + len(results) + i, iterations)
+                for i in range(restarts)])
+            best = max(results)
+            if sum(1 for (score, key) in results
+                    if score > best[0] - SCORE_TOLERANCE) >= agreement:
+                break
+    finally:
+        pool.terminate()
+        pool.join()
+
+    return best
+##}}}
+
 ##{{{ main
 def main():
     parser = argparse.ArgumentParser(prog="Substitution Cipher Support Program")
     parser.add_argument("--mode",help = "specifies the mode for the \
             program:", type = str, choices = ["encrypt", "decrypt", "analyze",\
-            "replace", "pattern"], required = True)
+            "replace", "pattern", "solve"], required = True)
     parser.add_argument("--input", help = "specifies the input file",\
             type = str, required = True)
     parser.add_argument("--key", help = "key for the substitution cipher",\
             required = False, type = str, default = alphabet)
     parser.add_argument("--pattern", help = "string pattern to search for",\
             required = False, type = str)
+    parser.add_argument("--quadgrams", help = "file of quadgram counts used\
+            by the solver", required = False, type = str)
+    parser.add_argument("--restarts", help = "number of independent climbs of\
+            the solver per round", required = False, type = int,\
+            default = RESTARTS)
+    parser.add_argument("--iterations", help = "number of swaps without\
+            improvement after which a climb stops", required = False,\
+            type = int, default = ITERATIONS)
+    parser.add_argument("--agreement", help = "number of climbs that have to\
+            reach the best score before the solver stops", required = False,\
+            type = int, default = AGREEMENT)
+    parser.add_argument("--max-restarts", help = "number of climbs after which\
+            the solver gives up waiting for agreement", required = False,\
+            type = int, default = MAX_RESTARTS)
+    parser.add_argument("--processes", help = "number of solver processes",\
+            required = False, type = int, default = None)
+    parser.add_argument("--seed", help = "seed of the first climb",\
+            required = False, type = int, default = 0)
 
     # add all possible characters to replace as arguments
     for c in alphabet:
@@ -201,6 +406,23 @@ def main():
         error_str = "File '" + fname + "' not found"
         usage(error_str)
 
+    if mode == "solve":
+        if not args.quadgrams:
+            error_str = "Missing input parameter, --quadgrams"
+            usage(error_str)
+        if args.restarts < 1 or args.iterations < 1 or args.agreement < 1 \
+                or args.max_restarts < 1 or \
+                (args.processes is not None and args.processes < 1):
+            error_str = "restarts, iterations, agreement, max-restarts and " \
+                    "processes must be positive"
+            usage(error_str)
+        try:
+            with open(args.quadgrams) as f:
+                table = read_quadgrams(f)
+        except (IOError, ValueError):
+            error_str = "File '" + args.quadgrams + "' is not a quadgram file"
+            usage(error_str)
+
     c = ""
     p = ""
 
@@ -208,8 +430,13 @@ def main():
         c = encrypt(content, key)
         print(c)
     elif mode == "decrypt":
-        p = decrypt(c, key)
+        p = decrypt(content, key)
         print(p)
+    elif mode == "solve":
+        (score, key) = solve(content, table, args.restarts, args.iterations,
+                args.processes, args.seed, args.agreement, args.max_restarts)
+        print("key: " + key + " (score " + str(round(score, 1)) + ")")
+        print(decrypt(content, key))
     elif mode == "analyze":
         print(get_frequency_of_characters(content))
     elif mode == "replace":
@@ -224,5 +451,5 @@ def main():
         usage("")
 ##}}}
 
-    if __name__ == '__main__':
-        main()
+if __name__ == '__main__':
+    main()
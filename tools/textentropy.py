@@ -2,15 +2,62 @@
 # -*- coding: utf-8 -*-
 
 import sys
+import os
+import re
 import argparse
-import urllib2
-import httplib
+import array
+import collections
+import glob
+import gzip
+import io
+import json
+import multiprocessing
 from math import log
 
+try:
+    from urllib.request import urlopen, Request
+    from urllib.error import HTTPError, URLError
+except ImportError:
+    from urllib2 import urlopen, Request, HTTPError, URLError
+
+# optional, speeds up counting the initials of large texts
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 UPPER_CASE_RANGE = range(0x41, 0x5b) # a-z = [0x61-0x7a]
 LOWER_CASE_RANGE = range(0x61, 0x7b) # A-Z = [0x41-0x5a]
 CHAR_RANGE = list(LOWER_CASE_RANGE) + list(UPPER_CASE_RANGE)
 
+# number of bytes read at once when counting the initials of a file
+CHUNK_SIZE = 1 << 20
+
+# initials of all words which follow a space
+WORD_START_RE = re.compile(b' ([A-Za-z])')
+INITIALS = [(c, bytes(bytearray([c]))) for c in CHAR_RANGE]
+
+# n-grams are counted over the letters of CHAR_RANGE, each one encoded as its
+# index (translate table); all other bytes are dropped
+NUM_SYMBOLS = len(CHAR_RANGE)
+MAX_NGRAM = 4
+SYMBOL_TABLE = bytes(bytearray(CHAR_RANGE.index(c) if c in CHAR_RANGE else 0
+    for c in range(256)))
+NON_LETTERS = bytes(bytearray(c for c in range(256) if c not in CHAR_RANGE))
+
+# base url of the Gutenberg project (may be replaced by a mirror) and the
+# paths of the text of a document, tried in this order
+GUTENBERG_URL = "http://www.gutenberg.org"
+GUTENBERG_PATHS = ["/files/{0}/{0}-0.txt", "/cache/epub/{0}/pg{0}.txt"]
+
+# prefix of Gutenberg IDs in a batch manifest (gb:<ID>[,<ID>...])
+MANIFEST_ID_PREFIX = "gb:"
+
+# counting buffers of a batch worker process, reused for every document
+batch_buffer = None
+batch_counts = None
+batch_download = None
+
 #{{{ error and usage
 def error(message):
     """ Prints error message."""
@@ -25,58 +72,179 @@ def usage(message):
         error(message + '\n')
         print("---------------------------------------------------------------")
 
-    usage_str = "Usage: " + sys.argv[0] + "-m=<mode> -f=<file> -i=<ID of file>"
+    usage_str = "Usage: " + sys.argv[0] + "-m=<mode> -f=<file> -i=<ID of file>\
+ -s=<state file(s)>"
     error(usage_str)
     print('\n')
     print("-------------------------------------------------------------------")
-    print("mode   - [file, gb]: file (reading text file from a given path;")
-    print("                     gb   (read text file from Gutenberg project)")
+    print("mode   - [file, gb, merge, batch]: file (reading text file from a given path;")
+    print("                            gb   (read text file from Gutenberg project)")
+    print("                            merge (combine saved count states)")
+    print("                            batch (all documents of a manifest file)")
     print("file   - path to a file containing the text")
     print("ID     - ID of a Gutenberg file")
+    print("state  - file storing the counts per source (path + size + mtime or")
+    print("         Gutenberg ID); an unchanged source is not counted again")
+    print("n      - length of the n-grams (1-4), reports H(X_n | X_1..X_n-1)")
+    print("unit   - [initials, chars]: n-grams of word initials or of letters")
+    print("window - number of symbols of a sliding window; prints the entropy")
+    print("         of every step-th window as csv or ndjson (file '-': stdin)")
+    print("batch  - file: manifest listing paths, globs and Gutenberg IDs")
+    print("         (gb:<ID>,...) to compute the entropy of, one per line")
+    print("cache  - directory storing downloaded Gutenberg files; cached files")
+    print("         are revalidated (ETag/Last-Modified) or used offline")
     print("-------------------------------------------------------------------")
     exit(1)
 #}}}
 
-#{{{ is website available
-def is_website_available(url):
+#{{{ fetch url
+def fetch_url(url, headers=None):
     """
-    Checks whether a given url is available
+    Requests a given url once and returns (status, body, headers): status is
+    304 if the resource was not modified (conditional request), None if the
+    website is not available.
     """
     try:
-        urllib2.urlopen(url)
-    except urllib2.HTTPError, e:
-        print(e.code)
-    except urllib2.URLError, e:
-        print(e.args)
+        response = urlopen(Request(url, headers=headers or {}))
+        try:
+            return (response.getcode(), response.read(), response.info())
+        finally:
+            response.close()
+    except HTTPError as e:
+        return (e.code, None, e.info())
+    except (URLError, IOError) as e:
+        error("{0}: {1}\n".format(url, e))
+        return (None, None, None)
+#}}}
+
+#{{{ Gutenberg cache
+class GutenbergCache(object):
+    """
+    Directory of downloaded Gutenberg files: the text of a document is stored
+    as <ID>.txt (or <ID>.txt.gz if compressed) next to <ID>.json holding the
+    path (relative to the base url) and the ETag/Last-Modified headers it was
+    fetched with.
+    """
+    def __init__(self, path, compress=False):
+        self.path = path
+        self.compress = compress
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def get_meta_path(self, id):
+        return os.path.join(self.path, str(id) + ".json")
+
+    def load(self, id):
+        """ returns (text, meta) of a cached document or (None, None) """
+        try:
+            with open(self.get_meta_path(id)) as f:
+                meta = json.load(f)
+            text_path = os.path.join(self.path, meta["file"])
+            if text_path.endswith(".gz"):
+                with gzip.open(text_path, 'rb') as f:
+                    return (f.read(), meta)
+            with open(text_path, 'rb') as f:
+                return (f.read(), meta)
+        except (IOError, OSError, ValueError, KeyError):
+            return (None, None)
+
+    def store(self, id, text, path, headers):
+        """ stores the text of a document fetched from path """
+        meta = {"path": path, "file": str(id) + ".txt",
+                "etag": headers.get("ETag"),
+                "last_modified": headers.get("Last-Modified")}
+        if self.compress:
+            meta["file"] += ".gz"
+
+        text_path = os.path.join(self.path, meta["file"])
+        if self.compress:
+            with gzip.open(text_path + ".tmp", 'wb') as f:
+                f.write(text)
+        else:
+            with open(text_path + ".tmp", 'wb') as f:
+                f.write(text)
+        os.rename(text_path + ".tmp", text_path)
+
+        meta_path = self.get_meta_path(id)
+        with open(meta_path + ".tmp", 'w') as f:
+            json.dump(meta, f, sort_keys=True)
+        os.rename(meta_path + ".tmp", meta_path)
 #}}}
 
 #{{{ read file from Gutenberg
-def read_gutenberg_file(id):
+class DownloadError(Exception):
+    """ raised if a Gutenberg file can neither be downloaded nor be cached """
+    pass
+
+
+def fetch_gutenberg_file(id, cache=None, offline=False, base_url=GUTENBERG_URL):
     """
     Takes an ID of an eBook archived by www.gutenberg.com and downloads the
-    corresponding book (.txt file).
+    corresponding book (.txt file); raises a DownloadError if that fails. A
+    cached book is revalidated with a
+    conditional request (at base_url) and used as it is unless a new version
+    is returned, i.e. also if offline is set or the website is not available.
     """
-    url = 'http://www.gutenberg.org/files/' + str(id) + '/' + str(id) + '-0.txt'
+    (text, meta) = (None, None)
+    if cache:
+        (text, meta) = cache.load(id)
 
-    text = ""
+    fetched = None
 
-    if is_website_available(url):
-        text = urllib2.urlopen(url).read()
-    else:
-        url  = 'http://www.gutenberg.org/cache/epub/' + str(id) + '/pg' + str(id) + '.txt'
-        if is_website_available(url):
-            text = urllib2.urlopen(url).read()
+    if text is not None:
+        if offline:
+            return text
+
+        headers = {}
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+        (status, body, info) = fetch_url(base_url + meta["path"], headers)
+
+        if status == 304:
+            return text
+        if status != 200 or b"<head>" in body:
+            error("website not available; using cached file\n")
+            return text
+        fetched = (meta["path"], body, info)
+    elif offline:
+        raise DownloadError("File " + str(id) + " not cached")
+
+    if fetched is None:
+        for path in GUTENBERG_PATHS:
+            path = path.format(id)
+            (status, body, info) = fetch_url(base_url + path)
+            if status == 200:
+                fetched = (path, body, info)
+                break
         else:
-            print("website not available; stop the program")
-            sys.exit(1)
+            raise DownloadError("File " + str(id) + " not available")
+
+    (path, text, info) = fetched
+
+    if b"<head>" in text:
+        raise DownloadError("File request was not accepted by " +
+                "www.gutenberg.org")
+
+    if cache:
+        cache.store(id, text, path, info)
+
+    return text
+
 
-    if "<head>" in text:
+def read_gutenberg_file(id, cache=None, offline=False, base_url=GUTENBERG_URL):
+    """
+    downloads a Gutenberg file like fetch_gutenberg_file, but stops the program
+    if that fails
+    """
+    try:
+        return fetch_gutenberg_file(id, cache, offline, base_url)
+    except DownloadError as e:
         print("--------------------------------------------------")
-        print("File request was not accepted by www.gutenberg.org")
+        print(str(e))
         print("--------------------------------------------------")
         sys.exit(1)
-
-    return text
 ##}}}
 
 ##{{{ read file
@@ -117,6 +285,622 @@ def count_initials(initials):
     return count_list
 ##}}}
 
+##{{{ count occurrence of initials (bytes)
+def count_initials_bytes(buf, counts=None, at_word_start=True):
+    """
+    Counts the initials of all words in a byte string buf into a list of 256
+    counters (one per byte value) without a loop over the words: with NumPy,
+    the bytes following a space are selected by a boolean mask and counted by
+    bincount; otherwise they are collected by a regular expression and counted
+    by bytes.count. at_word_start tells whether buf starts a word (i.e. it is
+    the start of the text or follows a space).
+    """
+    if counts is None:
+        counts = [0] * 256
+
+    if numpy is not None:
+        data = numpy.frombuffer(buf, dtype=numpy.uint8)
+        hist = numpy.bincount(data[1:][data[:-1] == 0x20], minlength=256)
+        for c in CHAR_RANGE:
+            counts[c] += int(hist[c])
+    else:
+        initials = b''.join(WORD_START_RE.findall(buf))
+        for (c, initial) in INITIALS:
+            counts[c] += initials.count(initial)
+
+    if at_word_start and buf:
+        counts[bytearray(buf[:1])[0]] += 1
+
+    return counts
+
+
+def get_count_list(counts):
+    """
+    converts a list of 256 counters into the count list of the initials (same
+    format as count_initials)
+    """
+    return dict((chr(i), counts[i]) for i in CHAR_RANGE)
+##}}}
+
+##{{{ count occurrence of initials (streaming)
+def count_initials_stream(f, chunk_size=CHUNK_SIZE):
+    """
+    Reads a file f (opened in binary mode) in chunks of chunk_size bytes and
+    counts the initials of its words incrementally. The result is the same as
+    count_initials(get_initials(get_word_list(f.read()))), but only one chunk
+    is held in memory. A word cut by a chunk boundary is not carried over as a
+    whole, it is sufficient to know whether the next chunk starts within a
+    word.
+    """
+    counts = [0] * 256
+
+    at_word_start = True
+
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            break
+
+        count_initials_bytes(chunk, counts, at_word_start)
+        at_word_start = chunk[-1:] == b' '
+
+    return get_count_list(counts)
+##}}}
+
+##{{{ count occurrence of initials (reused buffer)
+if sys.version_info[0] < 3:
+    def get_view(buf, size):
+        """ returns a read-only view on the first size bytes of buf """
+        return buffer(buf, 0, size)
+else:
+    def get_view(buf, size):
+        """ returns a read-only view on the first size bytes of buf """
+        return memoryview(buf)[:size]
+
+
+def count_initials_into(f, buf, counts):
+    """
+    counts the initials of a file f (opened in binary mode) into a list of 256
+    counters, reading it chunk by chunk into the preallocated bytearray buf
+    """
+    at_word_start = True
+
+    while True:
+        size = f.readinto(buf)
+        if not size:
+            break
+
+        count_initials_bytes(get_view(buf, size), counts, at_word_start)
+        at_word_start = buf[size - 1] == 0x20
+
+    return counts
+##}}}
+
+##{{{ count occurrence of initials (parallel)
+def find_word_boundary(f, pos, end):
+    """
+    returns the position after the first space at or after pos (at most end),
+    i.e. the next position where a word starts
+    """
+    f.seek(pos)
+    while pos < end:
+        chunk = f.read(min(CHUNK_SIZE, end - pos))
+        if not chunk:
+            break
+        i = chunk.find(b' ')
+        if i != -1:
+            return pos + i + 1
+        pos += len(chunk)
+    return end
+
+
+def get_aligned_ranges(path, num_ranges):
+    """
+    splits a file into num_ranges byte ranges (start, end) of about the same
+    size; every range except the first starts right after a space, so no word
+    is split between two ranges
+    """
+    size = os.path.getsize(path)
+    bounds = [0]
+
+    with open(path, 'rb') as f:
+        for i in range(1, num_ranges):
+            bounds.append(max(bounds[-1],
+                find_word_boundary(f, size * i // num_ranges, size)))
+    bounds.append(size)
+
+    return [(bounds[i], bounds[i + 1]) for i in range(num_ranges)
+            if bounds[i] < bounds[i + 1]]
+
+
+def count_initials_range(job):
+    """
+    counts the initials of the byte range (path, start, end) of a file into a
+    list of 256 counters
+    """
+    (path, start, end) = job
+    counts = [0] * 256
+    at_word_start = True
+
+    with open(path, 'rb') as f:
+        f.seek(start)
+        pos = start
+        while pos < end:
+            chunk = f.read(min(CHUNK_SIZE, end - pos))
+            if not chunk:
+                break
+            count_initials_bytes(chunk, counts, at_word_start)
+            at_word_start = chunk[-1:] == b' '
+            pos += len(chunk)
+
+    return counts
+
+
+def count_initials_parallel(path, jobs):
+    """
+    Splits a file into byte ranges aligned on spaces, counts the initials of
+    every range in a pool of jobs processes and merges the counters. Returns
+    the same count list as count_initials_stream.
+    """
+    counts = [0] * 256
+
+    ranges = [(path, start, end) for (start, end)
+            in get_aligned_ranges(path, jobs)]
+
+    pool = multiprocessing.Pool(jobs)
+    try:
+        for range_counts in pool.imap_unordered(count_initials_range, ranges):
+            for c in CHAR_RANGE:
+                counts[c] += range_counts[c]
+    finally:
+        pool.terminate()
+        pool.join()
+
+    return get_count_list(counts)
+##}}}
+
+##{{{ count n-grams
+def get_symbols(chunk, unit, at_word_start=True):
+    """
+    returns the symbols (bytes of letter indices, see SYMBOL_TABLE) of a chunk:
+    either the initials of its words or all of its letters
+    """
+    if unit == "initials":
+        if numpy is not None:
+            data = numpy.frombuffer(chunk, dtype=numpy.uint8)
+            letters = data[1:][data[:-1] == 0x20].tobytes()
+        else:
+            letters = b''.join(WORD_START_RE.findall(chunk))
+        if at_word_start:
+            letters = chunk[:1] + letters
+    else:
+        letters = chunk
+
+    return letters.translate(SYMBOL_TABLE, NON_LETTERS)
+
+
+class NgramCounter(object):
+    """
+    Counts the n-grams of a stream of symbols in a flat, preallocated array of
+    NUM_SYMBOLS**n counters: the n-gram s_1..s_n is counted at the index
+    s_1*NUM_SYMBOLS**(n-1) + ... + s_n. The last n-1 symbols of a chunk are
+    kept, so n-grams spanning two chunks are counted as well.
+    """
+    def __init__(self, n):
+        self.n = n
+        self.size = NUM_SYMBOLS ** n
+        if numpy is not None:
+            self.counts = numpy.zeros(self.size, dtype=numpy.int64)
+        else:
+            self.counts = array.array('L', [0]) * self.size
+        self.tail = b''
+
+    def add(self, symbols):
+        """ counts the n-grams of the next symbols of the stream """
+        n = self.n
+        data = self.tail + symbols
+        self.tail = data[max(0, len(data) - n + 1):]
+
+        if len(data) < n:
+            return
+
+        if numpy is not None:
+            values = numpy.frombuffer(data, dtype=numpy.uint8).astype(numpy.int64)
+            num_ngrams = len(values) - n + 1
+            index = values[:num_ngrams].copy()
+            for k in range(1, n):
+                index *= NUM_SYMBOLS
+                index += values[k:k + num_ngrams]
+            self.counts += numpy.bincount(index, minlength=self.size)
+        else:
+            counts = self.counts
+            size = self.size
+            index = 0
+            for (i, symbol) in enumerate(bytearray(data)):
+                index = (index * NUM_SYMBOLS + symbol) % size
+                if i >= n - 1:
+                    counts[index] += 1
+
+    def get_prefix_counts(self):
+        """ returns the counts of the (n-1)-gram prefixes of the n-grams """
+        if numpy is not None:
+            return self.counts.reshape(-1, NUM_SYMBOLS).sum(axis=1)
+        return [sum(self.counts[i:i + NUM_SYMBOLS])
+                for i in range(0, self.size, NUM_SYMBOLS)]
+
+    def compute_entropy(self):
+        """
+        returns the number of n-grams, the Shannon entropy of the n-grams
+        H(X_1..X_n) and the conditional entropy H(X_n | X_1..X_n-1) =
+        H(X_1..X_n) - H(X_1..X_n-1)
+        """
+        (total, ngram_entropy) = compute_array_entropy(self.counts)
+        if self.n == 1:
+            return (total, ngram_entropy, ngram_entropy)
+
+        (_, prefix_entropy) = compute_array_entropy(self.get_prefix_counts())
+        return (total, ngram_entropy, ngram_entropy - prefix_entropy)
+
+
+def compute_array_entropy(counts):
+    """
+    returns the total and the Shannon entropy of an array of counts, using
+    H = log2(N) - sum(c * log2(c)) / N
+    """
+    if numpy is not None:
+        counts = numpy.asarray(counts)
+        total = int(counts.sum())
+        nonzero = counts[counts > 0].astype(numpy.float64)
+        weighted = float((nonzero * numpy.log2(nonzero)).sum())
+    else:
+        total = sum(counts)
+        weighted = sum(c * log(c, 2) for c in counts if c > 0)
+
+    if total == 0:
+        return (0, 0.0)
+
+    return (total, log(total, 2) - weighted / total)
+
+
+def count_ngrams_stream(f, n, unit, chunk_size=CHUNK_SIZE):
+    """
+    reads a file f (opened in binary mode) in chunks of chunk_size bytes and
+    counts the n-grams of its initials or letters in a single pass
+    """
+    counter = NgramCounter(n)
+
+    at_word_start = True
+
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            break
+
+        counter.add(get_symbols(chunk, unit, at_word_start))
+        at_word_start = chunk[-1:] == b' '
+
+    return counter
+##}}}
+
+##{{{ sliding window entropy
+class WindowEntropy(object):
+    """
+    Shannon and min-entropy of the last window symbols. The counts are updated
+    incrementally when a symbol enters or leaves the window: the Shannon
+    entropy follows from the sum of c*log2(c) over the counts, the min-entropy
+    from the maximum count, which is tracked by the number of symbols per
+    count (it changes by at most one per update).
+    """
+    def __init__(self, window):
+        self.window = window
+        self.symbols = collections.deque()
+        self.counts = [0] * NUM_SYMBOLS
+        self.num_counts = [NUM_SYMBOLS] + [0] * window
+        self.max_count = 0
+        self.clogc = [0.0] + [c * log(c, 2) for c in range(1, window + 1)]
+        self.weighted = 0.0
+
+    def update(self, symbol, delta):
+        """ adds delta (1 or -1) to the count of a symbol """
+        count = self.counts[symbol]
+        new_count = count + delta
+        self.counts[symbol] = new_count
+        self.num_counts[count] -= 1
+        self.num_counts[new_count] += 1
+        self.weighted += self.clogc[new_count] - self.clogc[count]
+
+        if new_count > self.max_count:
+            self.max_count = new_count
+        elif self.num_counts[self.max_count] == 0:
+            self.max_count -= 1
+
+    def push(self, symbol):
+        """ moves the window one symbol forward """
+        if len(self.symbols) == self.window:
+            self.update(self.symbols.popleft(), -1)
+        self.symbols.append(symbol)
+        self.update(symbol, 1)
+
+    def compute_entropy(self):
+        """ returns the Shannon and the min-entropy of the current window """
+        total = len(self.symbols)
+        shannon_entropy = log(total, 2) - self.weighted / total
+        min_entropy = log(total, 2) - log(self.max_count, 2)
+
+        return (shannon_entropy, min_entropy)
+
+
+def format_window(start, end, shannon_entropy, min_entropy, out_format):
+    """ returns one line of the windowed entropy series (csv or ndjson) """
+    if out_format == "ndjson":
+        return json.dumps({"start": start, "end": end,
+            "shannon_entropy": round(shannon_entropy, 6),
+            "min_entropy": round(min_entropy, 6)}, sort_keys=True) + "\n"
+
+    return "{0},{1},{2:.6f},{3:.6f}\n".format(start, end, shannon_entropy,
+            min_entropy)
+
+
+def print_window_entropy(f, window, step, unit, out_format, out=sys.stdout):
+    """
+    Reads a file f (opened in binary mode, may be an unbounded stream like
+    stdin) and writes the entropy of every step-th window of window symbols
+    (initials or letters) as soon as the chunk containing its end is read.
+    start and end are the positions of the window in the symbol stream.
+    """
+    entropy = WindowEntropy(window)
+    read = getattr(f, "read1", f.read)
+    position = 0
+    at_word_start = True
+
+    if out_format == "csv":
+        out.write("start,end,shannon_entropy,min_entropy\n")
+
+    while True:
+        chunk = read(CHUNK_SIZE)
+        if not chunk:
+            break
+
+        lines = []
+        for symbol in bytearray(get_symbols(chunk, unit, at_word_start)):
+            entropy.push(symbol)
+            position += 1
+            if position >= window and (position - window) % step == 0:
+                lines.append(format_window(position - window, position,
+                    *(entropy.compute_entropy() + (out_format,))))
+        at_word_start = chunk[-1:] == b' '
+
+        out.write("".join(lines))
+        out.flush()
+##}}}
+
+##{{{ batch
+def read_manifest(path):
+    """
+    Reads a manifest file and returns its documents as a list of (source,
+    path, ID): a line is either a path, a glob pattern (all matching files in
+    sorted order) or a list of Gutenberg IDs (gb:<ID>[,<ID>...]); empty lines
+    and lines starting with # are skipped. A document listed more than once
+    (e.g. by a path and a glob pattern) is only returned the first time.
+    """
+    documents = []
+    sources = set()
+
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+
+            if line.startswith(MANIFEST_ID_PREFIX):
+                file_ids = [int(file_id) for file_id
+                        in line[len(MANIFEST_ID_PREFIX):].split(",")]
+                entries = [(get_source(file_id=file_id)[0], None, file_id)
+                        for file_id in file_ids]
+            elif glob.has_magic(line):
+                entries = [("file:" + os.path.abspath(file_path), file_path,
+                    None) for file_path in sorted(glob.glob(line))]
+            else:
+                entries = [("file:" + os.path.abspath(line), line, None)]
+
+            for document in entries:
+                if document[0] not in sources:
+                    sources.add(document[0])
+                    documents.append(document)
+
+    return documents
+
+
+def init_batch_worker(download):
+    """ allocates the counting buffers of a batch worker """
+    global batch_buffer, batch_counts, batch_download
+
+    batch_buffer = bytearray(CHUNK_SIZE)
+    batch_counts = [0] * 256
+    batch_download = download
+
+
+def count_document(document):
+    """
+    counts the initials of a document (source, path, ID) of a manifest and
+    returns (source, version, counts in the order of CHAR_RANGE, error)
+    """
+    (source, path, file_id) = document
+    counts = batch_counts
+    counts[:] = [0] * 256
+
+    try:
+        if path is not None:
+            version = get_source(path=path)[1]
+            with open(path, 'rb') as f:
+                count_initials_into(f, batch_buffer, counts)
+        else:
+            version = None
+            text = fetch_gutenberg_file(file_id, *batch_download)
+            count_initials_bytes(text, counts)
+    except (IOError, OSError, DownloadError) as e:
+        return (source, None, None, str(e))
+
+    return (source, version, [counts[c] for c in CHAR_RANGE], None)
+
+
+def format_result(source, counts, error_str, out_format):
+    """ returns the result row (csv or ndjson) of a document """
+    total = sum(counts) if counts else 0
+    (shannon_entropy, min_entropy) = (None, None)
+    if total:
+        (shannon_entropy, min_entropy) = compute_entropy(
+            dict((chr(c), n) for (c, n) in zip(CHAR_RANGE, counts)))
+
+    if out_format == "ndjson":
+        return json.dumps({"source": source, "initials": total,
+            "shannon_entropy": shannon_entropy, "min_entropy": min_entropy,
+            "error": error_str}, sort_keys=True) + "\n"
+
+    return ",".join([source, str(total),
+        "" if shannon_entropy is None else "{0:.6f}".format(shannon_entropy),
+        "" if min_entropy is None else "{0:.6f}".format(min_entropy),
+        error_str or ""]) + "\n"
+
+
+def run_batch(documents, jobs, download, out_format, state=None,
+        out=sys.stdout):
+    """
+    Computes the entropy of every document of a manifest in a pool of jobs
+    worker processes and writes one result row per document (in the order of
+    the manifest) and a last row with the merged counts of all documents
+    (source "total"). Documents stored unchanged in the state are not
+    counted again, all others are stored.
+    """
+    sources = {}
+    if state:
+        sources = load_state(state)
+
+    cached = {}
+    pending = []
+    for document in documents:
+        (source, path, file_id) = document
+        counts = None
+        try:
+            if path is not None:
+                version = get_source(path=path)[1]
+            else:
+                version = None
+            counts = get_state_counts(sources, source, version)
+        except OSError:
+            pass
+        if counts is not None:
+            cached[source] = [counts[chr(c)] for c in CHAR_RANGE]
+        else:
+            pending.append(document)
+
+    if out_format == "csv":
+        out.write("source,initials,shannon_entropy,min_entropy,error\n")
+
+    total_counts = [0] * len(CHAR_RANGE)
+
+    pool = multiprocessing.Pool(jobs, init_batch_worker, (download,))
+    try:
+        results = pool.imap(count_document, pending)
+        for (source, path, file_id) in documents:
+            if source in cached:
+                (version, counts, error_str) = (None, cached[source], None)
+            else:
+                (source, version, counts, error_str) = next(results)
+                if counts is not None and state:
+                    sources[source] = {"version": version, "counts": counts}
+
+            if counts is not None:
+                total_counts = [a + b for (a, b) in zip(total_counts, counts)]
+            out.write(format_result(source, counts, error_str, out_format))
+            out.flush()
+    finally:
+        pool.terminate()
+        pool.join()
+
+    if state:
+        save_state(state, sources)
+
+    out.write(format_result("total", total_counts, None, out_format))
+##}}}
+
+##{{{ count states
+def get_source(path=None, file_id=None):
+    """
+    returns (source, version) of a file (path, version: size and mtime) or a
+    Gutenberg document (ID, version: None)
+    """
+    if file_id is not None:
+        return ("gb:" + str(file_id), None)
+
+    st = os.stat(path)
+    return ("file:" + os.path.abspath(path), [st.st_size, st.st_mtime])
+
+
+def load_state(path):
+    """
+    reads a state file and returns a dictionary mapping each source to a
+    dictionary with its version and counts (list in the order of CHAR_RANGE)
+    """
+    if not os.path.exists(path):
+        return {}
+
+    with open(path) as f:
+        return json.load(f)["sources"]
+
+
+def save_state(path, sources):
+    """ writes the sources (see load_state) to a state file """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump({"sources": sources}, f, separators=(',', ':'),
+                sort_keys=True)
+    os.rename(tmp_path, path)
+
+
+def get_state_counts(sources, source, version):
+    """
+    returns the count list of a source stored in a state or None, if the
+    source is not stored or has changed
+    """
+    entry = sources.get(source)
+    if entry is None or entry["version"] != version:
+        return None
+
+    return dict((chr(c), n) for (c, n) in zip(CHAR_RANGE, entry["counts"]))
+
+
+def set_state_counts(sources, source, version, count_list):
+    """ stores the count list of a source in a state """
+    sources[source] = {"version": version,
+            "counts": [count_list[chr(c)] for c in CHAR_RANGE]}
+
+
+def merge_states(paths):
+    """
+    combines the sources of several state files (a source stored in more than
+    one file counts once: the file version with the latest mtime, the first
+    stored Gutenberg document) and returns the merged count list and the
+    number of sources
+    """
+    sources = {}
+
+    for path in paths:
+        for (source, entry) in load_state(path).items():
+            if source not in sources:
+                sources[source] = entry
+            elif entry["version"] is not None and \
+                    entry["version"][1] > sources[source]["version"][1]:
+                sources[source] = entry
+
+    count_list = dict.fromkeys([chr(i) for i in CHAR_RANGE], 0)
+    for entry in sources.values():
+        for (c, n) in zip(CHAR_RANGE, entry["counts"]):
+            count_list[chr(c)] += n
+
+    return (count_list, len(sources))
+##}}}
+
 ##{{{ compute entropy of given initials count list
 def compute_entropy(count_list):
     """
@@ -153,9 +937,21 @@ def print_entropy(shannon_entropy, min_entropy):
     print("------------------------------------------------")
 ##}}}
 
+##{{{ print n-gram entropy
+def print_ngram_entropy(n, unit, total, ngram_entropy, conditional_entropy):
+    digits = 3
+    print("------------------------------------------------")
+    print("{0}-grams of {1}: {2}".format(n, unit, total))
+    print("Shannon Entropy:     {0} bit/{1}-gram".format(
+        round(ngram_entropy, digits), n))
+    print("Conditional Entropy: {0} bit/char".format(
+        round(conditional_entropy, digits)))
+    print("------------------------------------------------")
+##}}}
+
 ##{{{ sanitize_inputs
 def sanitize_inputs(args):
-    if args.mode == "file" and not args.file:
+    if args.mode in ("file", "batch") and not args.file:
         error_str = "Missing input parameter, -f"
         usage(error_str)
 
@@ -163,32 +959,128 @@ def sanitize_inputs(args):
         error_str = "Missing input parameter, -i"
         usage(error_str)
 
+    if args.mode == "merge" and not args.state:
+        error_str = "Missing input parameter, -s"
+        usage(error_str)
+
+    if args.mode != "merge" and args.state and len(args.state) > 1:
+        error_str = "Only one state file can be updated, -s"
+        usage(error_str)
+
+    for path in args.state or []:
+        if args.mode == "merge" and not os.path.isfile(path):
+            error_str = "File '" + path + "' not found"
+            usage(error_str)
+
     if args.ID and args.ID < 1:
         error_str = "ID must be a positive Integer value"
         usage(error_str)
 
-    file_content = ""
+    if args.jobs < 1:
+        error_str = "Number of jobs must be a positive Integer value"
+        usage(error_str)
+
+    if args.ngram < 1 or args.ngram > MAX_NGRAM:
+        error_str = "Length of the n-grams must be between 1 and " + \
+                str(MAX_NGRAM)
+        usage(error_str)
 
-    if args.file:
+    if (args.ngram > 1 or args.unit != "initials") and \
+            (args.mode == "merge" or args.state or args.jobs > 1):
+        error_str = "n-grams are only counted in a single pass, -s and -j not supported"
+        usage(error_str)
+
+    if args.window is not None and args.window < 1:
+        error_str = "Window size must be a positive Integer value"
+        usage(error_str)
+
+    if args.step < 1:
+        error_str = "Step must be a positive Integer value"
+        usage(error_str)
+
+    if args.window and (args.mode == "merge" or args.state or args.jobs > 1 \
+            or args.ngram > 1):
+        error_str = "Windows are computed in a single pass, -s, -j and -n not supported"
+        usage(error_str)
+
+    if args.mode == "batch" and (args.ngram > 1 or args.unit != "initials" \
+            or args.window):
+        error_str = "Batch mode only counts initials, -n, -u and -w not supported"
+        usage(error_str)
+
+    if args.file == "-" and (args.state or args.jobs > 1 or \
+            args.mode == "batch"):
+        error_str = "Reading from stdin, -s and -j not supported"
+        usage(error_str)
+
+    if args.offline and not args.cache:
+        error_str = "Missing input parameter, -c"
+        usage(error_str)
+
+    cache = None
+    if args.cache:
         try:
-            f = open(args.file)
-            file_content = read_file(f)
+            cache = GutenbergCache(args.cache, args.compress)
+        except OSError:
+            error_str = "Cache directory '" + args.cache + "' not accessible"
+            usage(error_str)
+
+    f = None
+
+    # the file is only opened here, its content is streamed later on
+    if args.file == "-":
+        f = getattr(sys.stdin, "buffer", sys.stdin)
+    elif args.file:
+        try:
+            f = open(args.file, 'rb')
         except:
             error_str = "File '" + args.file + "' not found"
             usage(error_str)
 
-    return (args.mode, args.ID, file_content)
+    download = (cache, args.offline, args.url)
+
+    return (args.mode, args.ID, f, args.jobs, args.state, args.ngram, args.unit,
+            args.window, args.step, args.output, download)
 ##}}}
 
 ##{{{ add parser arguments
 def add_parser_arguments(parser):
     parser.add_argument("-m", "--mode",help = "specifies the mode for the \
-            program: file (takes a text file) or ID (takes an ID of a Gutenberg\
-            document)", type = str, choices = ["file", "gb"], required = True)
+            program: file (takes a text file), ID (takes an ID of a Gutenberg\
+            document), merge (combines saved count states) or batch (takes a\
+            manifest file)", type = str,
+            choices = ["file", "gb", "merge", "batch"], required = True)
     parser.add_argument("-f", "--file", help="specifies the path to the input\
-            file", type=str, required=False)
+            file ('-' reads from stdin) or of the manifest in batch mode",
+            type=str, required=False)
     parser.add_argument("-i", "--ID", help="specifies the ID of a Gutenberg\
             file", type=int, required=False)
+    parser.add_argument("-s", "--state", help="state file the counts of the\
+            source are read from (if unchanged) and saved to; merge mode:\
+            state files to combine", type=str, nargs="+", required=False)
+    parser.add_argument("-j", "--jobs", help="number of processes counting\
+            parts of the input file in parallel", type=int, default=1)
+    parser.add_argument("-n", "--ngram", help="length of the n-grams the\
+            conditional entropy is computed for (1-4)", type=int, default=1)
+    parser.add_argument("-u", "--unit", help="n-grams of word initials or of\
+            all letters", type=str, choices=["initials", "chars"],
+            default="initials")
+    parser.add_argument("-c", "--cache", help="directory the downloaded\
+            Gutenberg files are cached in", type=str, required=False)
+    parser.add_argument("-z", "--compress", help="compress the cached\
+            Gutenberg files", action="store_true")
+    parser.add_argument("--offline", help="use cached Gutenberg files without\
+            revalidating them", action="store_true")
+    parser.add_argument("--url", help="base url of the Gutenberg project or a\
+            mirror", type=str, default=GUTENBERG_URL)
+    parser.add_argument("-w", "--window", help="number of symbols of a sliding\
+            window; prints the entropy of every window", type=int,
+            required=False)
+    parser.add_argument("-t", "--step", help="number of symbols the window is\
+            moved forward between two printed windows", type=int, default=1)
+    parser.add_argument("-o", "--output", help="format of the windowed entropy\
+            series and of the batch results", type=str,
+            choices=["csv", "ndjson"], default="csv")
 
     return parser.parse_args()
 ##}}}
@@ -199,18 +1091,66 @@ def main():
 
     args = add_parser_arguments(parser)
 
-    (mode, file_id, file_content) = sanitize_inputs(args)
+    (mode, file_id, f, jobs, state, n, unit, window, step, out_format,
+            download) = sanitize_inputs(args)
+
+    if mode == "batch":
+        f.close()
+        try:
+            documents = read_manifest(f.name)
+        except ValueError:
+            error_str = "Invalid Gutenberg ID in manifest '" + f.name + "'"
+            usage(error_str)
+        run_batch(documents, jobs, download, out_format,
+                state[0] if state else None)
+        return
+
+    if mode == "gb" and (window or n > 1 or unit != "initials"):
+        f = io.BytesIO(read_gutenberg_file(file_id, *download))
+
+    if window:
+        print_window_entropy(f, window, step, unit, out_format)
+        f.close()
+        return
+
+    if n > 1 or unit != "initials":
+        counter = count_ngrams_stream(f, n, unit)
+        f.close()
+        print_ngram_entropy(n, unit, *counter.compute_entropy())
+        return
+
+    count_list = None
+
+    if mode == "merge":
+        (count_list, num_sources) = merge_states(state)
+        if not num_sources or not sum(count_list.values()):
+            error_str = "State files contain no initials, -s"
+            usage(error_str)
+        print("Merged {0} sources".format(num_sources))
+    elif state:
+        if mode == "file":
+            (source, version) = get_source(path=f.name)
+        else:
+            (source, version) = get_source(file_id=file_id)
+        sources = load_state(state[0])
+        count_list = get_state_counts(sources, source, version)
+
+    if mode == "file" and count_list is None:
+        if jobs > 1:
+            count_list = count_initials_parallel(f.name, jobs)
+        else:
+            count_list = count_initials_stream(f)
+
+    if mode == "gb" and count_list is None:
+        file_content = read_gutenberg_file(file_id, *download)
+        count_list = get_count_list(count_initials_bytes(file_content))
 
-    if mode == "file":
-        word_list = get_word_list(file_content)
-        initials = get_initials(word_list)
-        count_list = count_initials(initials)
+    if f:
+        f.close()
 
-    if mode == "gb":
-        file_content = read_gutenberg_file(file_id)
-        word_list = get_word_list(file_content)
-        initials = get_initials(word_list)
-        count_list = count_initials(initials)
+    if mode != "merge" and state:
+        set_state_counts(sources, source, version, count_list)
+        save_state(state[0], sources)
 
     print_count_list(count_list)
     print